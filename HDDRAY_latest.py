@@ -1,12 +1,111 @@
 import os
+import re
+import sys
+import math
+import asyncio
 import time
+import zlib
+import struct
+import random
+import hashlib
+import functools
+import itertools
 import configparser
+import bisect
+import heapq
+import queue
+import threading
 import subprocess
-from ctypes import windll, WinError, create_string_buffer, c_ulonglong, byref
+import multiprocessing
+from multiprocessing.connection import wait as wait_for_any
+from collections import namedtuple, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from ctypes import windll, WinError, create_string_buffer, c_ulonglong, c_ulong, c_char, byref, addressof
 
 SECTOR_SIZE = 512  # Define sector size for raw writes
+GENERIC_READ = 0x80000000
+GENERIC_WRITE = 0x40000000
+FILE_SHARE_READ_WRITE = 0x3  # FILE_SHARE_READ | FILE_SHARE_WRITE
+FILE_FLAG_NO_BUFFERING = 0x20000000
+IOCTL_DISK_GET_LENGTH_INFO = 0x7405C
+IOCTL_STORAGE_QUERY_PROPERTY = 0x2D1400
+STORAGE_ACCESS_ALIGNMENT_PROPERTY = 6
+IOCTL_DISK_PERFORMANCE = 0x70020
 settings_file = 'settings.ini'
 recovered_sectors_file = 'list of recovered sectors.txt'
+status_map_file = 'check status map.txt'
+sampling_report_file = 'sampling report.csv'
+heatmap_file = 'check heatmap.csv'
+drive_profiles_file = 'drive profiles.ini'
+sweep_report_file = 'throughput sweep.csv'
+iops_report_file = 'iops benchmark.csv'
+
+# Windows error codes grouped into classes that share a retry policy
+ERROR_CLASSES = {
+    5: 'sharing',       # ERROR_ACCESS_DENIED (drive held by another handle)
+    32: 'sharing',      # ERROR_SHARING_VIOLATION
+    33: 'sharing',      # ERROR_LOCK_VIOLATION
+    21: 'not_ready',    # ERROR_NOT_READY
+    121: 'timeout',     # ERROR_SEM_TIMEOUT
+    1460: 'timeout',    # ERROR_TIMEOUT
+    1117: 'io_device',  # ERROR_IO_DEVICE
+    23: 'crc',          # ERROR_CRC
+    27: 'crc',          # ERROR_SECTOR_NOT_FOUND
+}
+
+# Retry count and initial backoff (ms) per error class, see configure_retry_policy()
+RETRY_POLICY = {
+    'sharing': (8, 2),     # Lock contention clears in milliseconds
+    'not_ready': (4, 50),  # Drive spinning up or resetting
+    'timeout': (2, 20),
+    'io_device': (1, 10),
+    'crc': (0, 0),         # Hard media error, retrying only costs time
+}
+retry_max_delay = 1000  # Upper bound for a single backoff in ms
+# Retry counts and initial backoffs per error class like RETRY_POLICY, and the backoff limit in ms
+RetryPolicy = namedtuple('RetryPolicy', 'classes max_delay')
+
+RANDOM_CHUNK_SECTORS = 2048  # Random patterns are generated 1 MiB at a time
+REVOLUTION_RANGE_MS = (2.5, 25)  # 24000 to 2400 RPM, outside it the latency pattern isn't a rotation
+TRACK_PHASE_TRACKS = 4  # Track starts are only extrapolated this many tracks from the calibrated one
+
+# Undo journal index header: magic, size of the drive in sectors, serial number of the drive
+UNDO_INDEX_HEADER = struct.Struct('<8sQ64s')
+UNDO_MAGIC = b'HDDRAYUJ'
+# Undo journal index record: sector, blob offset in the .dat file, slot in the blob, flags
+UNDO_INDEX_RECORD = struct.Struct('<QQHB')
+UNDO_ZERO = 1        # Sector was all zeros, no data stored
+UNDO_UNREADABLE = 2  # Sector could not be read, nothing to restore
+undo_journal = None  # Active UndoJournal while a destructive mode runs
+physical_sector_size = SECTOR_SIZE  # Set by main() on 512e drives, writes are widened to it
+PHYSICAL_CACHE_SIZE = 16  # Physical sectors whose contents align_to_physical() remembers
+physical_cache = OrderedDict()  # First logical sector -> last known contents of a physical sector, None if unreadable
+progress = None  # (shared array, slot) in a multi-drive worker, see report_progress()
+profile_lock = threading.Lock()  # Replaced by a process lock in multi-drive workers
+group_budget = None  # TokenBucket in bytes shared by the drives behind one controller, see throttle_io()
+io_throttle = None  # IoThrottle of the drive when throttle limits are set
+
+# Start of DISK_PERFORMANCE: byte counters, cumulative read/write/idle time in 100 ns units, I/O counters
+DISK_PERFORMANCE = struct.Struct('<qqqqqIIII')
+DiskCounters = namedtuple('DiskCounters', 'bytes_read bytes_written read_time write_time idle_time reads writes queue_depth split_count')
+
+PIPELINE_QUEUE_SIZE = 64  # Items between two pipeline stages before the earlier one waits
+PIPELINE_DONE = object()  # End of stream marker passed between pipeline stages
+
+LOG_CHUNK_SIZE = 1024 * 1024  # Recovered sectors file is parsed 1 MiB at a time
+LogRecord = namedtuple('LogRecord', 'sector status attempts latency')
+# One block of async_scan(): block latency (None if the block read failed) and, for a failed
+# or slow block, the [(sector, status, latency)] of its sectors, like check_block()
+ScanResult = namedtuple('ScanResult', 'sector count latency sectors')
+# Record yielded by the repair engines: phase 'read' is the first read of a sector (status '+' good,
+# '!' slow, '-' unreadable, latency in ms), phase 'repair' its repair ('+' repaired or verified, '-' failed).
+# attempts is the number of repair attempts used, 0 if the sector passed without one; note is None or
+# a remark for the Notes column of the log, e.g. PRESERVE_FALLBACK_NOTE
+SectorResult = namedtuple('SectorResult', 'sector phase status attempts latency note')
+PRESERVE_FALLBACK_NOTE = "unreadable, patterns written instead of its data"
+# A log line with at least 7 columns: sector, status, attempts, the 5th column and a pipe
+# if there is an 8th column (VTC16.8 format, where the 5th column is the latency)
+LOG_LINE_PATTERN = re.compile(rb'^[ \t]*(\d+)[ \t]*\|[ \t]*([^|\s]*)[ \t]*\|([^|\n]*)\|[^|\n]*\|([^|\n]*)\|[^|\n]*\|(?:[^|\n]*(\|))?', re.M)
 
 # Function to read settings from the ini file
 def read_settings():
@@ -25,13 +124,69 @@ def read_settings():
         'f1_sector_write': int(config['DEFAULT'].get('f1_sector_write', 3)),
         'f1_sector_read': int(config['DEFAULT'].get('f1_sector_read', 5)),
         'f1_sector_attempts': int(config['DEFAULT'].get('f1_sector_attempts', 3)),
+        'f1_block_sectors': int(config['DEFAULT'].get('f1_block_sectors', 128)),
         'repair_sector_write': int(config['DEFAULT'].get('repair_sector_write', 3)),
         'repair_sector_read': int(config['DEFAULT'].get('repair_sector_read', 5)),
         'repair_sector_attempts': int(config['DEFAULT'].get('repair_sector_attempts', 3)),
+        'repair_block_sectors': int(config['DEFAULT'].get('repair_block_sectors', 128)),
+        'repair_method': config['DEFAULT'].get('repair_method', 'patterns').strip().lower(),
+        'preserve_reads': int(config['DEFAULT'].get('preserve_reads', 16)),
+        'preserve_majority_vote': int(config['DEFAULT'].get('preserve_majority_vote', 0)),
+        'patterns': config['DEFAULT'].get('patterns', '55,aa'),
+        'pattern_seed': int(config['DEFAULT'].get('pattern_seed', 1)),
+        'undo_journal': int(config['DEFAULT'].get('undo_journal', 0)),
+        'physical_align': int(config['DEFAULT'].get('physical_align', 1)),
+        'check_block_sectors': int(config['DEFAULT'].get('check_block_sectors', 0)),  # 0 = suggestion from the drive profile or 256
+        'check_queue_depth': int(config['DEFAULT'].get('check_queue_depth', 0)),  # 0 = suggestion from the drive profile or 4
+        'scan_order': config['DEFAULT'].get('scan_order', 'sequential').strip().lower(),
+        'scan_block_sectors': int(config['DEFAULT'].get('scan_block_sectors', 16384)),
+        'heatmap_cells': int(config['DEFAULT'].get('heatmap_cells', 100)),
+        'neighbour_scan': int(config['DEFAULT'].get('neighbour_scan', 1)),
+        'neighbour_window': int(config['DEFAULT'].get('neighbour_window', 64)),
+        'neighbour_max_window': int(config['DEFAULT'].get('neighbour_max_window', 4096)),
+        'track_sectors': int(config['DEFAULT'].get('track_sectors', 0)),
+        'track_align': int(config['DEFAULT'].get('track_align', 0)),
+        'calibration_zones': int(config['DEFAULT'].get('calibration_zones', 8)),
+        'calibration_step': int(config['DEFAULT'].get('calibration_step', 32)),
+        'calibration_max_offset': int(config['DEFAULT'].get('calibration_max_offset', 8192)),
+        'calibration_repeats': int(config['DEFAULT'].get('calibration_repeats', 3)),
+        'auto_latency': int(config['DEFAULT'].get('auto_latency', 0)),
+        'latency_margin': int(config['DEFAULT'].get('latency_margin', 20)),
+        'benchmark_zones': int(config['DEFAULT'].get('benchmark_zones', 16)),
+        'benchmark_seek_samples': int(config['DEFAULT'].get('benchmark_seek_samples', 200)),
+        'benchmark_throughput_mib': int(config['DEFAULT'].get('benchmark_throughput_mib', 64)),
+        'sweep_points': int(config['DEFAULT'].get('sweep_points', 1000)),
+        'sweep_read_mib': int(config['DEFAULT'].get('sweep_read_mib', 8)),
+        'iops_queue_depths': config['DEFAULT'].get('iops_queue_depths', '1,2,4,8,16,32'),
+        'iops_block_sizes': config['DEFAULT'].get('iops_block_sizes', '512,4096,65536,1048576'),
+        'iops_cell_seconds': int(config['DEFAULT'].get('iops_cell_seconds', 5)),
+        'auto_tune': int(config['DEFAULT'].get('auto_tune', 0)),
+        'auto_tune_block_sectors': config['DEFAULT'].get('auto_tune_block_sectors', '128,256,1024,2048'),
+        'auto_tune_queue_depths': config['DEFAULT'].get('auto_tune_queue_depths', '1,2,4,8'),
+        'auto_tune_sample_mib': int(config['DEFAULT'].get('auto_tune_sample_mib', 8)),
+        'auto_tune_zones': int(config['DEFAULT'].get('auto_tune_zones', 8)),
+        'sample_count': int(config['DEFAULT'].get('sample_count', 100000)),
+        'sample_zones': int(config['DEFAULT'].get('sample_zones', 100)),
+        'sample_time_budget': int(config['DEFAULT'].get('sample_time_budget', 600)),
         'mode': int(config['DEFAULT'].get('mode', 1)),
         'drive_number': int(config['DEFAULT'].get('drive_number', 1)),
+        'drive_numbers': config['DEFAULT'].get('drive_numbers', '').strip(),
+        'group_bandwidth_mib': int(config['DEFAULT'].get('group_bandwidth_mib', 0)),
+        'throttle_iops': int(config['DEFAULT'].get('throttle_iops', 0)),
+        'throttle_mib': int(config['DEFAULT'].get('throttle_mib', 0)),
+        'throttle_adaptive': int(config['DEFAULT'].get('throttle_adaptive', 0)),
+        'throttle_target_latency': int(config['DEFAULT'].get('throttle_target_latency', 20)),
+        'idle_block_sectors': int(config['DEFAULT'].get('idle_block_sectors', 128)),
+        'idle_wait_ms': int(config['DEFAULT'].get('idle_wait_ms', 500)),
+        'idle_poll_ms': int(config['DEFAULT'].get('idle_poll_ms', 20)),
         'auto_mode': int(config['DEFAULT'].get('auto_mode', 1)),
-        'error_use_handle': int(config['DEFAULT'].get('error_use_handle', 3))  # New setting for retry attempts
+        'error_use_handle': int(config['DEFAULT'].get('error_use_handle', 3)),  # New setting for retry attempts
+        'retry_sharing': int(config['DEFAULT'].get('retry_sharing', 8)),
+        'retry_not_ready': int(config['DEFAULT'].get('retry_not_ready', 4)),
+        'retry_timeout': int(config['DEFAULT'].get('retry_timeout', 2)),
+        'retry_io_device': int(config['DEFAULT'].get('retry_io_device', 1)),
+        'retry_crc': int(config['DEFAULT'].get('retry_crc', 0)),
+        'retry_max_delay': int(config['DEFAULT'].get('retry_max_delay', 1000))
     }
     return settings
 
@@ -83,98 +238,1005 @@ def select_drive(settings):
         print("Invalid choice.")
         return None
 
-def open_drive(drive, access_mode):
-    """Open a drive with the specified access mode and exclusive access."""
+def select_drives(settings):
+    """Return the drives listed in drive_numbers, None if any of them doesn't exist or is listed twice."""
+    drives = list_raw_drives()
+    selected = []
+    for number in parse_int_list(settings['drive_numbers']):
+        if not 1 <= number <= len(drives):
+            print(f"Invalid drive number {number} in drive_numbers.")
+            return None
+        if drives[number - 1][0] in selected:
+            # Two workers on one drive would share its directory, log and undo journal
+            print(f"Drive number {number} is listed twice in drive_numbers.")
+            return None
+        device_id, model, size = drives[number - 1]
+        print(f"Attention: Using drive {number} ({model}, {size}GB) [{device_id}]")
+        selected.append(device_id)
+    time.sleep(5)  # Wait for 5 seconds
+    return selected
+
+def get_drive_controllers():
+    """Map every physical drive to the controller it hangs on, e.g. 'SCSI port 2'.
+
+    Drives on one port share the HBA or SATA controller link. USB drives
+    usually share a host controller without a usable port number, so they
+    form a single 'USB' group.
+    """
     try:
-        handle = windll.kernel32.CreateFileW(
-            drive,  # Raw drive path
-            access_mode,  # Access mode
-            0,  # No sharing (exclusive access)
-            None,
-            3,  # OPEN_EXISTING
-            0,
-            None,
+        result = subprocess.run(
+            ["powershell", "-Command", "Get-CimInstance Win32_DiskDrive | ForEach-Object { \"$($_.DeviceID)|$($_.InterfaceType)|$($_.SCSIPort)\" }"],
+            capture_output=True,
+            text=True,
         )
-        if handle == -1:
-            raise WinError()
-        return handle
-    except WinError as e:
-        print(f"Error opening drive {drive}: {e}")
-        return None
+    except Exception as e:
+        print(f"Error reading drive controllers: {e}")
+        return {}
+    controllers = {}
+    for line in result.stdout.splitlines():
+        parts = line.strip().split('|')
+        if len(parts) == 3 and parts[0]:
+            device_id, interface, port = parts
+            controllers[device_id] = 'USB' if interface == 'USB' else f"{interface} port {port}"
+    return controllers
+
+class TokenBucket:
+    """Rate limit shared by several processes: `rate` units per second, bursts of up to `burst` units.
+
+    take() may drive the bucket into debt, the caller then sleeps until the
+    debt is paid off outside the lock, so waiting callers are served in order.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = multiprocessing.Value('d', burst, lock=False)
+        self.stamp = multiprocessing.Value('d', time.monotonic(), lock=False)
+        self.lock = multiprocessing.Lock()
+
+    def take(self, amount):
+        """Take `amount` units, waiting until the rate allows it."""
+        with self.lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self.tokens.value + (now - self.stamp.value) * self.rate) - amount
+            self.tokens.value = tokens
+            self.stamp.value = now
+        if tokens < 0:
+            time.sleep(-tokens / self.rate)
+
+class IoThrottle:
+    """IOPS and MB/s limits, so a scan can run on a disk that serves other programs.
+
+    With throttle_adaptive the limits are scaled by a factor that is halved
+    whenever the I/O of other programs gets slower than throttle_target_latency
+    and grows back by a twentieth per interval while it stays below. The
+    latency of the other programs comes from the disk performance counters
+    minus the reads and writes done here.
+    """
+
+    INTERVAL = 0.5  # Seconds between looks at the disk counters
+    MIN_FACTOR = 0.01
+    ADAPTIVE_IOPS = 1000  # IOPS ceiling for the adaptive mode when throttle_iops is not set
+
+    def __init__(self, settings, drive):
+        self.target = settings['throttle_target_latency']
+        self.iops = settings['throttle_iops'] or (self.ADAPTIVE_IOPS if settings['throttle_adaptive'] else 0)
+        self.bytes_per_s = settings['throttle_mib'] * 1024 * 1024
+        self.iops_bucket = TokenBucket(self.iops, max(1, self.iops / 10)) if self.iops else None
+        self.bytes_bucket = TokenBucket(self.bytes_per_s, self.bytes_per_s / 10) if self.bytes_per_s else None
+        self.factor = 1.0
+        self.lock = threading.Lock()
+        self.own_count = 0
+        self.own_time = 0.0
+        self.sample = None  # (time, DiskCounters) of the last look at the counters
+        self.handle = None
+        if settings['throttle_adaptive']:
+            self.handle = open_drive(drive, 0, FILE_SHARE_READ_WRITE)  # Query access only
+            try:
+                get_disk_performance(self.handle)
+            except OSError as e:
+                print(f"Disk performance counters not available ({e}), using fixed throttle limits.")
+                self.close()
+
+    def take(self, size):
+        """Wait until one request of `size` bytes fits the limits."""
+        self.adapt()
+        if self.iops_bucket:
+            self.iops_bucket.take(1)
+        if self.bytes_bucket:
+            self.bytes_bucket.take(size)
+
+    def finished(self, latency):
+        """Account one of our own requests, so it isn't mistaken for foreground I/O."""
+        with self.lock:
+            self.own_count += 1
+            self.own_time += latency
+
+    def adapt(self):
+        if not self.handle:
+            return
+        with self.lock:
+            now = time.monotonic()
+            if self.sample and now - self.sample[0] < self.INTERVAL:
+                return
+            counters = get_disk_performance(self.handle)
+            if self.sample:
+                previous = self.sample[1]
+                count = counters.reads + counters.writes - previous.reads - previous.writes - self.own_count
+                busy = (counters.read_time + counters.write_time - previous.read_time - previous.write_time) / 10000 - self.own_time
+                if count > 0 and busy / count > self.target:
+                    self.factor = max(self.MIN_FACTOR, self.factor / 2)
+                else:
+                    self.factor = min(1.0, self.factor + 0.05)
+                if self.iops_bucket:
+                    self.iops_bucket.rate = self.iops * self.factor
+                if self.bytes_bucket:
+                    self.bytes_bucket.rate = self.bytes_per_s * self.factor
+            self.sample = (now, counters)
+            self.own_count = 0
+            self.own_time = 0.0
+
+    def close(self):
+        if self.handle:
+            close_drive(self.handle)
+            self.handle = None
+
+def get_disk_performance(handle):
+    """Cumulative DiskCounters of the drive behind an open handle."""
+    buffer = create_string_buffer(88)  # sizeof(DISK_PERFORMANCE)
+    returned = c_ulong(0)
+    if not windll.kernel32.DeviceIoControl(handle, IOCTL_DISK_PERFORMANCE, None, 0, buffer, len(buffer), byref(returned), None):
+        raise WinError()
+    return DiskCounters(*DISK_PERFORMANCE.unpack_from(buffer.raw))
+
+def throttle_io(size):
+    """Wait until `size` bytes fit the bandwidth budget and throttle limits; called before the latency timing starts."""
+    if group_budget:
+        group_budget.take(size)
+    if io_throttle:
+        io_throttle.take(size)
+
+def throttle_done(latency):
+    """Report the latency of a request that went through throttle_io()."""
+    if io_throttle:
+        io_throttle.finished(latency)
+
+def report_progress(done, total):
+    """Publish how far the running mode is for the multi-drive progress view, no-op for a single drive."""
+    if progress:
+        shared, slot = progress
+        shared[slot] = done / total if total else 1.0
+
+def retry_policy(settings):
+    """RetryPolicy with the per-class retry counts and the backoff limit from the settings."""
+    classes = {error_class: (settings[f'retry_{error_class}'], base_delay) for error_class, (_, base_delay) in RETRY_POLICY.items()}
+    return RetryPolicy(classes, settings['retry_max_delay'])
+
+def configure_retry_policy(settings):
+    """Apply the per-class retry counts from the settings to the whole process."""
+    global retry_max_delay
+    policy = retry_policy(settings)
+    RETRY_POLICY.update(policy.classes)
+    retry_max_delay = policy.max_delay
+
+def classify_error(error):
+    """Map an OSError to its retry class, 'other' if the code is unknown."""
+    return ERROR_CLASSES.get(getattr(error, 'winerror', None), 'other')
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with jitter, in seconds."""
+    delay = min(max_delay, base_delay * (2 ** attempt))
+    return random.uniform(delay / 2, delay) / 1000
+
+def run_with_retry(operation, description, retries, policy=None):
+    """Run operation() and retry it according to the class of each failure.
+
+    Errors without a known class get `retries` attempts in total, like before.
+    The last error is re-raised once the budget of its class is spent.
+    `policy` is a RetryPolicy, the one set by configure_retry_policy() if None.
+    """
+    classes, max_delay = policy or (RETRY_POLICY, retry_max_delay)
+    failures = {}
+    while True:
+        try:
+            return operation()
+        except OSError as e:
+            error_class = classify_error(e)
+            attempt = failures.get(error_class, 0)
+            failures[error_class] = attempt + 1
+            max_retries, base_delay = classes.get(error_class, (retries - 1, 10))
+            print(f"Error {description}: {e} [{error_class}]")
+            if attempt >= max_retries:
+                raise
+            time.sleep(backoff_delay(attempt, base_delay, max_delay))
+
+def open_drive(drive, access_mode, share_mode=0, flags=0):
+    """Open a drive with the specified access mode, exclusive access unless share_mode is given."""
+    handle = windll.kernel32.CreateFileW(
+        drive,  # Raw drive path
+        access_mode,  # Access mode
+        share_mode,  # 0 = no sharing (exclusive access)
+        None,
+        3,  # OPEN_EXISTING
+        flags,
+        None,
+    )
+    if handle == -1:
+        raise WinError()
+    return handle
 
 def close_drive(handle):
     """Close the drive handle."""
     if handle:
         windll.kernel32.CloseHandle(handle)
 
-def read_sector_raw(drive, sector, retries):
-    """Read a raw sector with retry mechanism."""
-    for attempt in range(retries):
-        handle = open_drive(drive, 0x80000000)  # GENERIC_READ
-        if not handle:
-            if attempt < retries - 1:
-                time.sleep(1)  # Wait a bit before retrying
-                continue
-            else:
-                return False, None, None
+def read_sectors_raw(drive, sector, count, retries):
+    """Read `count` consecutive raw sectors in a single request with retry mechanism."""
+    size = count * SECTOR_SIZE
 
+    def read():
+        handle = open_drive(drive, 0x80000000)  # GENERIC_READ
         try:
-            buffer = create_string_buffer(SECTOR_SIZE)
+            buffer = create_string_buffer(size)
             distance_to_move = c_ulonglong(sector * SECTOR_SIZE)
             if not windll.kernel32.SetFilePointerEx(handle, distance_to_move, None, 0):
                 raise WinError()
 
             bytes_read = c_ulonglong(0)
+            throttle_io(size)
             start_time = time.time()  # Start timing the read operation
-            if not windll.kernel32.ReadFile(handle, buffer, SECTOR_SIZE, byref(bytes_read), None):
+            if not windll.kernel32.ReadFile(handle, buffer, size, byref(bytes_read), None):
                 raise WinError()
             end_time = time.time()  # End timing the read operation
             latency = (end_time - start_time) * 1000  # Convert to milliseconds
-
+            throttle_done(latency)
+            return buffer.raw, latency
+        finally:
             close_drive(handle)
-            return True, buffer.raw, latency
-        except PermissionError as e:
-            print(f"Error reading sector {sector}: {e}")
-            close_drive(handle)
-            if attempt < retries - 1:
-                time.sleep(1)  # Wait a bit before retrying
-            else:
-                return False, None, None
-        except WinError as e:
-            print(f"Error reading sector {sector}: {e}")
-            close_drive(handle)
-            return False, None, None
 
-def write_sector_raw(drive, sector, pattern, retries):
-    """Write a raw sector with retry mechanism."""
-    for attempt in range(retries):
-        handle = open_drive(drive, 0xC0000000)  # GENERIC_READ | GENERIC_WRITE
-        if not handle:
-            if attempt < retries - 1:
-                time.sleep(1)  # Wait a bit before retrying
-                continue
-            else:
-                return False
+    try:
+        data, latency = run_with_retry(read, f"reading sector {sector}", retries)
+    except OSError:
+        return False, None, None
+    return True, data, latency
+
+def read_sector_raw(drive, sector, retries):
+    """Read a raw sector with retry mechanism."""
+    return read_sectors_raw(drive, sector, 1, retries)
+
+def write_sectors_raw(drive, sector, data, retries):
+    """Write whole sectors of `data` starting at `sector` in a single request with retry mechanism."""
+    if physical_sector_size > SECTOR_SIZE:
+        sector, data = align_to_physical(drive, sector, data, retries)
+    if undo_journal:
+        undo_journal.save(drive, sector, len(data) // SECTOR_SIZE, retries)
 
+    def write():
+        handle = open_drive(drive, 0xC0000000)  # GENERIC_READ | GENERIC_WRITE
         try:
-            buffer = create_string_buffer(pattern * (SECTOR_SIZE // len(pattern)))
+            buffer = create_string_buffer(data, len(data))
             distance_to_move = c_ulonglong(sector * SECTOR_SIZE)
             if not windll.kernel32.SetFilePointerEx(handle, distance_to_move, None, 0):
                 raise WinError()
 
             bytes_written = c_ulonglong(0)
-            if not windll.kernel32.WriteFile(handle, buffer, SECTOR_SIZE, byref(bytes_written), None):
+            throttle_io(len(data))
+            start_time = time.perf_counter()
+            if not windll.kernel32.WriteFile(handle, buffer, len(data), byref(bytes_written), None):
                 raise WinError()
-
+            throttle_done((time.perf_counter() - start_time) * 1000)
+        finally:
             close_drive(handle)
+
+    try:
+        run_with_retry(write, f"writing sector {sector}", retries)
+    except OSError:
+        success = False
+    else:
+        success = True
+    # Keep the remembered physical sectors in step with the drive, their contents are unknown after a failed write
+    ratio = physical_sector_size // SECTOR_SIZE
+    for start in range(sector, sector + len(data) // SECTOR_SIZE, ratio):
+        if start not in physical_cache:
+            continue
+        if success:
+            physical_cache[start] = data[(start - sector) * SECTOR_SIZE:(start - sector + ratio) * SECTOR_SIZE]
+        else:
+            del physical_cache[start]
+    return success
+
+def align_to_physical(drive, sector, data, retries):
+    """Widen a write to whole physical sectors so the drive doesn't have to read-modify-write.
+
+    The extra logical sectors get their current contents; if their physical
+    sector can't be read (the usual case for a weak sector) they get the edge
+    sector of `data` instead, their data is lost inside the drive anyway.
+    Repairs write the same sector over and over, so the contents of the last
+    PHYSICAL_CACHE_SIZE physical sectors (or that they are unreadable) are
+    kept in physical_cache and updated by every write, not read again.
+    """
+    ratio = physical_sector_size // SECTOR_SIZE
+    count = len(data) // SECTOR_SIZE
+    first = sector - sector % ratio
+    end = -(-(sector + count) // ratio) * ratio
+    if first == sector and end == sector + count:
+        return sector, data
+
+    # The physical sectors holding the head and the tail, one read if they are the same
+    spans = {first: None, end - ratio: None}
+    for start in spans:
+        if start in physical_cache:
+            physical_cache.move_to_end(start)
+        else:
+            success, contents, _ = read_sectors_raw(drive, start, ratio, retries)
+            physical_cache[start] = contents if success else None
+            if len(physical_cache) > PHYSICAL_CACHE_SIZE:
+                physical_cache.popitem(last=False)
+        spans[start] = physical_cache[start]
+
+    head = spans[first]
+    if head:
+        head = head[:(sector - first) * SECTOR_SIZE]
+    else:
+        head = data[:SECTOR_SIZE] * (sector - first)
+    tail = spans[end - ratio]
+    if tail:
+        tail = tail[(sector + count - (end - ratio)) * SECTOR_SIZE:]
+    else:
+        tail = data[-SECTOR_SIZE:] * (end - sector - count)
+    return first, head + data + tail
+
+def get_physical_sector_size(drive):
+    """Physical sector size of the drive in bytes, SECTOR_SIZE if the drive doesn't report it."""
+    try:
+        handle = open_drive(drive, 0, FILE_SHARE_READ_WRITE)  # Query access only
+    except OSError as e:
+        print(f"Error querying sector size of {drive}: {e}")
+        return SECTOR_SIZE
+    try:
+        # STORAGE_PROPERTY_QUERY in, STORAGE_ACCESS_ALIGNMENT_DESCRIPTOR out
+        query = (c_ulong * 3)(STORAGE_ACCESS_ALIGNMENT_PROPERTY, 0, 0)
+        descriptor = (c_ulong * 7)()
+        returned = c_ulong(0)
+        if not windll.kernel32.DeviceIoControl(handle, IOCTL_STORAGE_QUERY_PROPERTY, byref(query), 12, byref(descriptor), 28, byref(returned), None):
+            return SECTOR_SIZE
+        logical, physical = descriptor[4], descriptor[5]
+        if logical != SECTOR_SIZE or not physical or physical % SECTOR_SIZE:
+            return SECTOR_SIZE
+        return physical
+    finally:
+        close_drive(handle)
+
+def write_sector_raw(drive, sector, pattern, retries):
+    """Write a raw sector with retry mechanism."""
+    return write_sectors_raw(drive, sector, pattern * (SECTOR_SIZE // len(pattern)), retries)
+
+def aligned_buffer(size, alignment=4096):
+    """Buffer aligned for unbuffered I/O (FILE_FLAG_NO_BUFFERING needs aligned memory)."""
+    raw = create_string_buffer(size + alignment)
+    return (c_char * size).from_buffer(raw, -addressof(raw) % alignment)
+
+def read_block(handle, sector, count, buffer):
+    """Read `count` sectors into `buffer` on an already open handle, returns the latency in ms."""
+    size = count * SECTOR_SIZE
+    if not windll.kernel32.SetFilePointerEx(handle, c_ulonglong(sector * SECTOR_SIZE), None, 0):
+        raise WinError()
+    bytes_read = c_ulonglong(0)
+    throttle_io(size)
+    start_time = time.perf_counter()
+    if not windll.kernel32.ReadFile(handle, buffer, size, byref(bytes_read), None):
+        raise WinError()
+    latency = (time.perf_counter() - start_time) * 1000
+    throttle_done(latency)
+    if bytes_read.value != size:
+        raise OSError(f"short read of {bytes_read.value} bytes at sector {sector}")
+    return latency
+
+def open_read_only(drive):
+    """Open a drive for reading only, shared with other users and bypassing the cache."""
+    return open_drive(drive, GENERIC_READ, FILE_SHARE_READ_WRITE, FILE_FLAG_NO_BUFFERING)
+
+def get_drive_sectors(drive):
+    """Return the size of the drive in sectors."""
+    handle = open_drive(drive, GENERIC_READ, FILE_SHARE_READ_WRITE)  # The length IOCTL needs read access
+    try:
+        length = c_ulonglong(0)
+        returned = c_ulong(0)
+        if not windll.kernel32.DeviceIoControl(handle, IOCTL_DISK_GET_LENGTH_INFO, None, 0, byref(length), 8, byref(returned), None):
+            raise WinError()
+        return length.value // SECTOR_SIZE
+    finally:
+        close_drive(handle)
+
+def scan_range(settings, drive):
+    """Return (min_sector, max_sector) for the read-only modes, max_sector = 0 means the whole drive.
+
+    None if the size of the drive can't be read.
+    """
+    try:
+        max_sector = settings['max_sector'] or get_drive_sectors(drive)
+    except OSError as e:
+        print(f"Error reading the size of {drive}: {e}")
+        return None
+    return settings['min_sector'], max_sector
+
+def drive_name(drive):
+    """Device path reduced to a name usable for files and directories, e.g. PHYSICALDRIVE1."""
+    return drive.replace('\\', '').replace('.', '')
+
+def get_drive_serial(drive):
+    """Serial number of the drive, used to key its profile; the device path if it can't be read."""
+    try:
+        result = subprocess.run(
+            ["powershell", "-Command", f"(Get-CimInstance Win32_DiskDrive | Where-Object DeviceID -eq '{drive}').SerialNumber"],
+            capture_output=True,
+            text=True,
+        )
+        serial = result.stdout.strip()
+        if serial:
+            return serial
+    except Exception as e:
+        print(f"Error reading serial number of {drive}: {e}")
+    return drive.replace('\\', '').replace('.', '')
+
+def load_drive_profile(serial):
+    """Return the stored profile of the drive with this serial as a dict, empty if it was never profiled.
+
+    The serial comes from get_drive_serial(), which starts PowerShell, so callers look it up once.
+    """
+    config = configparser.ConfigParser()
+    config.read(drive_profiles_file)
+    return dict(config[serial]) if config.has_section(serial) else {}
+
+def save_drive_profile(serial, values):
+    """Merge `values` into the stored profile of the drive with this serial."""
+    with profile_lock:  # Drives scanned at the same time share the profiles file
+        config = configparser.ConfigParser()
+        config.read(drive_profiles_file)
+        if not config.has_section(serial):
+            config.add_section(serial)
+        for key, value in values.items():
+            config[serial][key] = str(value)
+        with open(drive_profiles_file, 'w') as f:
+            config.write(f)
+
+def load_track_layout(serial):
+    """Return the calibrated [(zone first sector, sectors per track, track start)] of the drive."""
+    profile = load_drive_profile(serial)
+    layout = []
+    for zone in range(int(profile.get('track_zones', 0))):
+        first, track_sectors, track_start = (int(value) for value in profile[f'track_zone_{zone}'].split(','))
+        layout.append((first, track_sectors, track_start))
+    return sorted(layout)
+
+def track_at(layout, sector):
+    """Return (sectors per track, start of the track holding `sector`), None without a layout.
+
+    The calibrated track length is off by up to about 1%, and that error adds up
+    with every track between `sector` and the track start found by calibration.
+    Further than TRACK_PHASE_TRACKS tracks from it (or if calibration found no
+    start) the start is None: blocks cut to the track length there would
+    still straddle the track boundaries, just with more requests.
+    """
+    if not layout:
+        return None
+    index = max(0, bisect.bisect_right(layout, (sector, float('inf'), 0)) - 1)
+    _, track_sectors, track_start = layout[index]
+    if track_start < 0 or abs(sector - track_start) > TRACK_PHASE_TRACKS * track_sectors:
+        return track_sectors, None
+    return track_sectors, track_start + (sector - track_start) // track_sectors * track_sectors
+
+def split_at_tracks(layout, sector, count, max_count):
+    """Yield (sector, count) blocks of at most max_count sectors that don't cross a track boundary.
+
+    Where the track start isn't known, the blocks are left at max_count.
+    """
+    end = sector + count
+    while sector < end:
+        take = min(max_count, end - sector)
+        track = track_at(layout, sector)
+        if track and track[1] is not None:
+            track_sectors, track_start = track
+            take = min(take, track_start + track_sectors - sector)
+        yield sector, take
+        sector += take
+
+def scan_order(settings, min_sector, max_sector):
+    """Yield (sector, count) chunks of scan_block_sectors covering the range in the configured order.
+
+    'sequential' goes from min_sector up. 'progressive' visits the chunks in
+    bit-reversed index order (van der Corput sequence): first the start of the
+    range, then the middle, then the quarters and so on, so a run stopped at
+    any point has covered the whole range evenly, just more coarsely.
+    """
+    chunk_sectors = max(1, settings['scan_block_sectors'])
+    chunks = -(-(max_sector - min_sector) // chunk_sectors)
+    if settings['scan_order'] != 'progressive':
+        order = range(chunks)
+    else:
+        bits = max(1, (chunks - 1).bit_length())
+        order = (index for index in (int(f"{i:0{bits}b}"[::-1], 2) for i in range(1 << bits)) if index < chunks)
+    for index in order:
+        sector = min_sector + index * chunk_sectors
+        yield sector, min(chunk_sectors, max_sector - sector)
+
+class Heatmap:
+    """Checked, slow and bad sector counts for a fixed number of cells over the scan range."""
+
+    def __init__(self, min_sector, max_sector, cells):
+        self.min_sector = min_sector
+        self.max_sector = max_sector
+        self.cells = max(1, min(cells, max_sector - min_sector))
+        self.checked = [0] * self.cells
+        self.slow = [0] * self.cells
+        self.bad = [0] * self.cells
+
+    def cell(self, sector):
+        return (sector - self.min_sector) * self.cells // (self.max_sector - self.min_sector)
+
+    def add(self, first, count, status):
+        # Chunks never span many cells, so splitting per cell boundary is cheap
+        while count:
+            cell = self.cell(first)
+            cell_end = self.min_sector + -(-(cell + 1) * (self.max_sector - self.min_sector) // self.cells)
+            take = min(count, cell_end - first)
+            self.checked[cell] += take
+            if status == '!':
+                self.slow[cell] += take
+            elif status == '-':
+                self.bad[cell] += take
+            first += take
+            count -= take
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write("cell,first_sector,last_sector,checked,slow,bad\n")
+            for cell in range(self.cells):
+                first = self.min_sector + -(-cell * (self.max_sector - self.min_sector) // self.cells)
+                last = self.min_sector + -(-(cell + 1) * (self.max_sector - self.min_sector) // self.cells) - 1
+                f.write(f"{cell},{first},{last},{self.checked[cell]},{self.slow[cell]},{self.bad[cell]}\n")
+
+class DefectScheduler:
+    """Scan order that inspects the neighbourhood of every defect before going on.
+
+    Sectors come from scan_order() until report_defect() is called. Then a
+    window of neighbour_window sectors on each side of the defect is queued and
+    scanned first; a defect found inside a window queues a window twice as wide
+    (up to neighbour_max_window), so damaged areas are mapped while they keep
+    producing defects. With track_sectors set (or a calibrated track layout),
+    windows one track before and after the defect are queued as well, at lower
+    priority, since scratches cross neighbouring tracks at about the same angle.
+    """
+
+    def __init__(self, settings, min_sector, max_sector, layout=None):
+        self.settings = settings
+        self.layout = layout
+        self.min_sector = min_sector
+        self.max_sector = max_sector
+        self.chunk_sectors = max(1, settings['scan_block_sectors'])
+        self.queue = []  # (priority, order, first, last, width, mirror)
+        self.queued = 0
+        self.inspected = set()  # Sectors scanned out of the base order
+        self.done_chunks = set()
+        self.chunk = None
+        self.cursor = None
+        self.width = 0  # Window width of the sector being scanned, 0 in the base order
+        self.mirror = False
+
+    def scanned(self, sector):
+        if sector in self.inspected:
             return True
-        except Exception as e:
-            print(f"Error writing sector {sector}: {e}")
-            close_drive(handle)
-            if attempt < retries - 1:
-                time.sleep(1)  # Wait a bit before retrying
+        chunk = (sector - self.min_sector) // self.chunk_sectors
+        return chunk in self.done_chunks or (chunk == self.chunk and sector < self.cursor)
+
+    def queue_window(self, centre, width, priority, mirror):
+        first = max(self.min_sector, centre - width)
+        last = min(self.max_sector - 1, centre + width)
+        if first <= last:
+            self.queued += 1
+            heapq.heappush(self.queue, (priority, self.queued, first, last, width, mirror))
+
+    def report_defect(self, sector):
+        """Queue the neighbourhood of a defective sector."""
+        if not self.settings['neighbour_scan']:
+            return
+        window = self.settings['neighbour_window']
+        width = min(self.width * 2, self.settings['neighbour_max_window']) if self.width else window
+        self.queue_window(sector, width, 0, False)
+        track = self.settings['track_sectors'] or (track_at(self.layout, sector) or (0, 0))[0]
+        if track and not self.mirror:
+            self.queue_window(sector - track, window, 1, True)
+            self.queue_window(sector + track, window, 1, True)
+
+    def windows(self):
+        """Yield the queued window sectors not scanned yet, most urgent window first."""
+        while self.queue:
+            _, _, first, last, self.width, self.mirror = heapq.heappop(self.queue)
+            for sector in range(first, last + 1):
+                if not self.scanned(sector):
+                    self.inspected.add(sector)
+                    yield sector
+        self.width, self.mirror = 0, False
+
+    def __iter__(self):
+        self.width, self.mirror = 0, False
+        for chunk_start, chunk_count in scan_order(self.settings, self.min_sector, self.max_sector):
+            self.chunk = (chunk_start - self.min_sector) // self.chunk_sectors
+            for sector in range(chunk_start, chunk_start + chunk_count):
+                self.cursor = sector
+                yield from self.windows()
+                if sector not in self.inspected:
+                    yield sector
+                else:
+                    self.inspected.discard(sector)  # Passed by the base order, no need to remember it
+            self.done_chunks.add(self.chunk)
+        self.cursor = self.max_sector
+        yield from self.windows()
+
+class ReadOnlyHandles:
+    """One read-only handle and aligned buffer per worker thread, for concurrent reads."""
+
+    def __init__(self, drive, buffer_sectors):
+        self.drive = drive
+        self.buffer_sectors = buffer_sectors
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.handles = []
+
+    def get(self):
+        """Return (handle, buffer) of the calling thread, opening the drive on first use."""
+        if not hasattr(self.local, 'handle'):
+            self.local.handle = open_read_only(self.drive)
+            self.local.buffer = aligned_buffer(self.buffer_sectors * SECTOR_SIZE)
+            with self.lock:
+                self.handles.append(self.local.handle)
+        return self.local.handle, self.local.buffer
+
+    def close(self):
+        with self.lock:
+            for handle in self.handles:
+                close_drive(handle)
+            self.handles.clear()
+
+class LatencyStats:
+    """Latency summary with a logarithmic histogram, so memory doesn't grow with the number of reads."""
+
+    BUCKETS_PER_DECADE = 20
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = {}
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        self.min = latency if self.min is None else min(self.min, latency)
+        self.max = latency if self.max is None else max(self.max, latency)
+        bucket = int(math.log10(max(latency, 0.001)) * self.BUCKETS_PER_DECADE)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def percentile(self, fraction):
+        """Upper bound of the histogram bucket holding the given fraction of reads."""
+        if not self.count:
+            return None
+        needed = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= needed:
+                return min(self.max, 10 ** ((bucket + 1) / self.BUCKETS_PER_DECADE))
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return "no reads"
+        return (f"{self.count} reads, min {self.min:.2f}ms, avg {self.total / self.count:.2f}ms, "
+                f"p50 {self.percentile(0.5):.2f}ms, p99 {self.percentile(0.99):.2f}ms, "
+                f"p99.9 {self.percentile(0.999):.2f}ms, max {self.max:.2f}ms")
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def parse_int_list(value):
+    """Parse a comma separated list of integers from the settings."""
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def parse_positive_list(value):
+    """Positive integers of a comma separated list from the settings, empty if it doesn't parse."""
+    try:
+        return [number for number in parse_int_list(value) if number > 0]
+    except ValueError:
+        return []
+
+def engine_cell(block_size, queue_depth, latencies, errors, elapsed):
+    """Throughput and latency percentiles of one (block size, queue depth) benchmark run."""
+    return {
+        'block_size': block_size,
+        'queue_depth': queue_depth,
+        'iops': len(latencies) / elapsed,
+        'mb_per_s': len(latencies) * block_size / (1024 * 1024) / elapsed,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'p999': percentile(latencies, 0.999),
+        'errors': errors,
+    }
+
+def best_engine_config(cells, max_latency):
+    """Cell with the highest MB/s whose p99 stays within max_latency, the fastest one if none does."""
+    if not cells:
+        return None
+    within = [cell for cell in cells if cell['p99'] is not None and cell['p99'] <= max_latency]
+    return max(within or cells, key=lambda cell: cell['mb_per_s'])
+
+def mismatched_sectors(data, expected, first_sector):
+    """Return the sectors of a block whose contents differ from the expected data."""
+    data, expected = memoryview(data), memoryview(expected)
+    return [
+        first_sector + offset // SECTOR_SIZE
+        for offset in range(0, len(expected), SECTOR_SIZE)
+        if data[offset:offset + SECTOR_SIZE] != expected[offset:offset + SECTOR_SIZE]
+    ]
+
+class SectorRanges:
+    """Set of sectors kept as sorted, coalesced [start, end) ranges.
+
+    A journal over a whole drive written front to back is a single range,
+    so memory depends on how fragmented the writes were, not on their size.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, first, end):
+        """Add the sectors first..end-1, merging with ranges they overlap or touch."""
+        i = bisect.bisect_left(self.ends, first)
+        j = bisect.bisect_right(self.starts, end)
+        if i < j:
+            self.count -= sum(self.ends[k] - self.starts[k] for k in range(i, j))
+            first = min(first, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [first]
+        self.ends[i:j] = [end]
+        self.count += end - first
+
+    def missing(self, first, end):
+        """Yield the (start, end) parts of first..end-1 that are not in the set."""
+        i = bisect.bisect_right(self.ends, first)
+        while first < end:
+            if i == len(self.starts) or self.starts[i] >= end:
+                yield first, end
+                return
+            if self.starts[i] > first:
+                yield first, self.starts[i]
+            first = max(first, self.ends[i])
+            i += 1
+
+def sync_file(file):
+    """Write `file` through to the disk, not just to the OS cache."""
+    file.flush()
+    os.fsync(file.fileno())
+
+class UndoJournal:
+    """Append-only store of original sector contents, saved before they are overwritten.
+
+    Every write request adds one zlib compressed blob to the .dat file and one
+    index record per sector to the .idx file. A sector is only journaled the
+    first time it is overwritten, all-zero sectors are stored as a flag only.
+
+    The files are named after the serial number of the drive, and the .idx
+    header holds the serial and the size of the drive: PHYSICALDRIVE numbers
+    can change after a reboot, so a journal must never be restored by number.
+    Raises ValueError if the existing journal belongs to another drive, and
+    OSError if the drive can't be identified.
+    """
+
+    def __init__(self, drive):
+        self.serial = get_drive_serial(drive)
+        self.drive_sectors = get_drive_sectors(drive)
+        name = re.sub(r'[^\w.-]', '_', self.serial)
+        self.data_path = f"undo journal {name}.dat"
+        self.index_path = f"undo journal {name}.idx"
+        header = self.read_header()
+        if header and header != (self.serial, self.drive_sectors):
+            raise ValueError(f"{self.index_path} was written for drive {header[0]} with {header[1]} sectors, "
+                             f"not {self.serial} with {self.drive_sectors} sectors")
+        self.saved = SectorRanges()
+        # Records are written in runs of ascending sectors, a run is added as one range
+        run_start = run_end = None
+        for sector, _, _, _ in self.entries():
+            if sector != run_end:
+                if run_start is not None:
+                    self.saved.add(run_start, run_end)
+                run_start = sector
+            run_end = sector + 1
+        if run_start is not None:
+            self.saved.add(run_start, run_end)
+        self.data_file = open(self.data_path, 'ab')
+        self.index_file = open(self.index_path, 'ab')
+        if not header:
+            self.index_file.truncate(0)  # Also drops a header cut short by a crash
+            self.index_file.write(UNDO_INDEX_HEADER.pack(UNDO_MAGIC, self.drive_sectors, self.serial.encode('utf-8')[:64]))
+            sync_file(self.index_file)
+
+    def read_header(self):
+        """Return (serial, drive sectors) from the .idx header, None without a complete journal."""
+        if not os.path.exists(self.index_path):
+            return None
+        with open(self.index_path, 'rb') as f:
+            data = f.read(UNDO_INDEX_HEADER.size)
+        if len(data) < UNDO_INDEX_HEADER.size:
+            return None
+        magic, drive_sectors, serial = UNDO_INDEX_HEADER.unpack(data)
+        if magic != UNDO_MAGIC:
+            raise ValueError(f"{self.index_path} is not an undo journal")
+        return serial.rstrip(b'\x00').decode('utf-8', 'replace'), drive_sectors
+
+    def entries(self):
+        """Yield (sector, blob offset, slot, flags) for every journaled sector."""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'rb') as f:
+            f.seek(UNDO_INDEX_HEADER.size)
+            while True:
+                chunk = f.read(UNDO_INDEX_RECORD.size * 4096)
+                if not chunk:
+                    break
+                # A record cut short by a crash is ignored
+                chunk = chunk[:len(chunk) - len(chunk) % UNDO_INDEX_RECORD.size]
+                yield from UNDO_INDEX_RECORD.iter_unpack(chunk)
+
+    def read_blob(self, offset):
+        """Return the decompressed sector data of the blob at `offset`."""
+        with open(self.data_path, 'rb') as f:
+            f.seek(offset)
+            length, = struct.unpack('<I', f.read(4))
+            return zlib.decompress(f.read(length))
+
+    def read_originals(self, drive, sectors, retries):
+        """Read the current contents of `sectors`, unreadable ones are left out."""
+        first = sectors[0]
+        success, data, _ = read_sectors_raw(drive, first, sectors[-1] - first + 1, retries)
+        if success:
+            return {s: data[(s - first) * SECTOR_SIZE:(s - first + 1) * SECTOR_SIZE] for s in sectors}
+
+        originals = {}
+        for s in sectors:
+            success, data, _ = read_sector_raw(drive, s, retries)
+            if success:
+                originals[s] = data
+        return originals
+
+    def save(self, drive, sector, count, retries):
+        """Journal the sectors of the range that were not saved before."""
+        missing = list(self.saved.missing(sector, sector + count))
+        sectors = [s for start, end in missing for s in range(start, end)]
+        if not sectors:
+            return
+
+        originals = self.read_originals(drive, sectors, retries)
+        offset = self.data_file.tell()
+        blob, records = [], []
+        for s in sectors:
+            data = originals.get(s)
+            if data is None:
+                records.append(UNDO_INDEX_RECORD.pack(s, offset, 0, UNDO_UNREADABLE))
+            elif not data.strip(b'\x00'):
+                records.append(UNDO_INDEX_RECORD.pack(s, offset, 0, UNDO_ZERO))
             else:
-                return False
+                records.append(UNDO_INDEX_RECORD.pack(s, offset, len(blob), 0))
+                blob.append(data)
+
+        # The data has to be on disk before the index points to it, and both before the drive is written
+        if blob:
+            compressed = zlib.compress(b''.join(blob))
+            self.data_file.write(struct.pack('<I', len(compressed)) + compressed)
+            sync_file(self.data_file)
+        self.index_file.write(b''.join(records))
+        sync_file(self.index_file)
+        for start, end in missing:
+            self.saved.add(start, end)
+
+    def close(self):
+        self.data_file.close()
+        self.index_file.close()
+
+    def retire(self):
+        """Close the journal and rename its files, so the next destructive run starts a new one.
+
+        Sectors restored once must be journaled again before they are overwritten
+        again, or a later restore would bring back the older contents.
+        """
+        self.close()
+        suffix = time.strftime('restored %Y%m%d-%H%M%S')
+        base = os.path.splitext(self.index_path)[0]
+        number = 1
+        while os.path.exists(f"{base} {suffix}.idx"):  # Retired earlier in the same second
+            number += 1
+            suffix = f"{time.strftime('restored %Y%m%d-%H%M%S')} {number}"
+        retired = [f"{os.path.splitext(path)[0]} {suffix}{os.path.splitext(path)[1]}" for path in (self.data_path, self.index_path)]
+        os.replace(self.data_path, retired[0])
+        os.replace(self.index_path, retired[1])
+        return retired
+
+def fill_pattern(unit):
+    """Pattern that repeats `unit` over every sector."""
+    def generate(sector, count):
+        return unit * (count * SECTOR_SIZE // len(unit))
+    return generate
+
+_walking_ones = bytes(1 << (i % 8) for i in range(SECTOR_SIZE + 8))
+_checkerboard = ((b'\x55\xAA' * SECTOR_SIZE)[:SECTOR_SIZE], (b'\xAA\x55' * SECTOR_SIZE)[:SECTOR_SIZE])
+
+def walking_ones(sector, count):
+    """A single set bit walking through every byte, shifted by one bit per sector."""
+    return b''.join(_walking_ones[s % 8:s % 8 + SECTOR_SIZE] for s in range(sector, sector + count))
+
+def checkerboard(sector, count):
+    """Alternating 0x55/0xAA bytes, inverted on every other sector."""
+    return b''.join(_checkerboard[s % 2] for s in range(sector, sector + count))
+
+@functools.lru_cache(maxsize=8)
+def _random_chunk(seed, chunk):
+    return hashlib.shake_128(f"{seed}:{chunk}".encode()).digest(RANDOM_CHUNK_SECTORS * SECTOR_SIZE)
+
+def random_pattern(seed):
+    """Pseudo-random pattern that can be regenerated from (seed, sector) alone."""
+    def generate(sector, count):
+        data = []
+        end = sector + count
+        while sector < end:
+            chunk, offset = divmod(sector, RANDOM_CHUNK_SECTORS)
+            take = min(end - sector, RANDOM_CHUNK_SECTORS - offset)
+            data.append(_random_chunk(seed, chunk)[offset * SECTOR_SIZE:(offset + take) * SECTOR_SIZE])
+            sector += take
+        return b''.join(data)
+    return generate
+
+PATTERNS = {
+    '00': fill_pattern(b'\x00'),
+    'ff': fill_pattern(b'\xFF'),
+    '55': fill_pattern(b'\x55'),
+    'aa': fill_pattern(b'\xAA'),
+    'walking_ones': walking_ones,
+    'checkerboard': checkerboard,
+}
+
+def get_patterns(settings):
+    """Build the pattern list from the comma separated `patterns` setting.
+
+    Each entry is a name from PATTERNS, 'random' (seeded with pattern_seed)
+    or a hex string that is repeated over the sector, e.g. 'DB6D'.
+    """
+    patterns = []
+    for name in settings['patterns'].lower().split(','):
+        name = name.strip()
+        if name in PATTERNS:
+            patterns.append(PATTERNS[name])
+        elif name == 'random':
+            patterns.append(random_pattern(settings['pattern_seed']))
+        else:
+            try:
+                unit = bytes.fromhex(name)
+            except ValueError:
+                unit = b''
+            if not unit or SECTOR_SIZE % len(unit):
+                print(f"Unknown pattern '{name}' in settings, skipped.")
+                continue
+            patterns.append(fill_pattern(unit))
+    if not patterns:
+        patterns = [PATTERNS['55'], PATTERNS['aa']]
+    return patterns
 
 def verify_sector(drive, sector, pattern, retries):
     """Verify if the sector contains the pattern."""
@@ -183,7 +1245,59 @@ def verify_sector(drive, sector, pattern, retries):
         return True, latency
     return False, latency
 
+def majority_vote(reads):
+    """Byte-wise majority of several reads of the same sector."""
+    return bytes(max(set(column), key=column.count) for column in zip(*reads))
+
+def preserve_sector(settings, drive, sector, verbose=True):
+    """Re-read a weak sector until it returns data and write that data back once.
+
+    Returns (success, attempts), or None if the sector could not be read at all
+    and there is no data left to preserve.
+    """
+    preserve_reads = settings['preserve_reads']
+    max_latency = settings['max_latency']
+    retries = settings['error_use_handle']
+    needed = 3 if settings['preserve_majority_vote'] else 1
+
+    reads = []
+    for attempt in range(preserve_reads):
+        success, data, latency = read_sector_raw(drive, sector, retries)
+        if success:
+            reads.append(data)
+            if len(reads) >= needed:
+                break
+    if not reads:
+        return None
+
+    data = majority_vote(reads) if len(reads) > 1 else reads[0]
+    write_sector_raw(drive, sector, data, retries)
+    verified, latency = verify_sector(drive, sector, data, retries)
+    if verified and latency <= max_latency:
+        return True, attempt + 1
+
+    if verbose:
+        if verified:
+            print(f"Sector {sector} access time {latency:.2f}ms still exceeds max latency {max_latency}ms after rewrite")
+        else:
+            print(f"Sector {sector} could not be rewritten with its own data")
+    return False, attempt + 1
+
 def repair_sector(settings, drive, sector, patterns, verbose=True):
+    """Repair one sector, returns (success, attempts, note).
+
+    `note` is None, or says that a preserving repair fell back to the
+    patterns because the sector couldn't be read, i.e. its data is gone.
+    """
+    note = None
+    if settings['repair_method'] == 'preserve':
+        result = preserve_sector(settings, drive, sector, verbose)
+        if result is not None:
+            return result + (None,)
+        note = PRESERVE_FALLBACK_NOTE
+        if verbose:
+            print(f"Sector {sector} could not be read, falling back to pattern repair")
+
     max_repair_attempts = settings['repair_sector_attempts']
     max_repair_writes = settings['repair_sector_write']
     max_repair_reads = settings['repair_sector_read']
@@ -191,115 +1305,446 @@ def repair_sector(settings, drive, sector, patterns, verbose=True):
     retries = settings['error_use_handle']
 
     for attempt in range(max_repair_attempts):
+        repaired = True
         for pattern in patterns:
+            expected = pattern(sector, 1)
             for _ in range(max_repair_writes):
-                write_sector_raw(drive, sector, pattern, retries)
+                write_sector_raw(drive, sector, expected, retries)
+
+            # Every pattern has to read back correctly, not just the last one
+            verified = False
+            for _ in range(max_repair_reads):
+                success, latency = verify_sector(drive, sector, expected, retries)
+                if latency is not None and latency > max_latency:
+                    if verbose:
+                        print(f"Sector {sector} access time {latency:.2f}ms exceeds max latency {max_latency}ms")
+                    return False, attempt + 1, note
+                if success:
+                    verified = True
+                    break
+            if not verified:
+                repaired = False
+                break
 
-        for _ in range(max_repair_reads):
-            success, latency = verify_sector(drive, sector, pattern, retries)
-            if success and latency <= max_latency:
-                return True, attempt + 1
-            elif latency > max_latency:
-                print(f"Sector {sector} access time {latency:.2f}ms exceeds max latency {max_latency}ms")
-                return False, attempt + 1
+        if repaired:
+            return True, attempt + 1, note
 
     if verbose:
         print(f"Sector {sector} could not be repaired after {max_repair_attempts} attempts")
-    return False, max_repair_attempts
+    return False, max_repair_attempts, note
 
-def f1_mode(settings, drive):
-    print(f"Running f1 mode on drive {drive}...")
-    patterns = [b'\x55', b'\xAA']  # Binary patterns
+def repair_range(settings, drive, sector, count, patterns, verbose=True):
+    """Repair `count` adjacent sectors, returns {sector: (success, attempts, note)} like repair_sector().
 
-    min_sector = settings['min_sector']
-    max_sector = settings['max_sector']
+    Each pattern is written over the whole range in one request and verified
+    with one block read; only the sectors still failing go through repair_sector().
+    """
+    if count == 1 or settings['repair_method'] == 'preserve':
+        # Preserving repair keeps each sector's own data, so there is no common block to write
+        return {s: repair_sector(settings, drive, s, patterns, verbose) for s in range(sector, sector + count)}
+
+    max_repair_writes = settings['repair_sector_write']
+    max_latency = settings['max_latency']
+    retries = settings['error_use_handle']
+    block = range(sector, sector + count)
+
+    failed = set()
+    for pattern in patterns:
+        expected = pattern(sector, count)
+        for _ in range(max_repair_writes):
+            write_sectors_raw(drive, sector, expected, retries)
+
+        success, data, latency = read_sectors_raw(drive, sector, count, retries)
+        if not success or latency > max_latency:
+            failed.update(block)
+            break
+        failed.update(mismatched_sectors(data, expected, sector))
+
+    results = {}
+    for s in block:
+        if s in failed:
+            results[s] = repair_sector(settings, drive, s, patterns, verbose)
+        else:
+            results[s] = (True, 1, None)
+    return results
+
+def f1_sector(settings, drive, sector, patterns):
+    """Write and verify the patterns on a single sector, returns (success, attempts used)."""
     f1_sector_write = settings['f1_sector_write']
     f1_sector_read = settings['f1_sector_read']
     f1_sector_attempts = settings['f1_sector_attempts']
     max_latency = settings['max_latency']
     retries = settings['error_use_handle']
 
-    if max_sector == 0:
-        max_sector = (128 * 1024 * 1024) // SECTOR_SIZE
+    attempts = 0
+    while attempts < f1_sector_attempts:
+        success = True
+        for pattern in patterns:
+            expected = pattern(sector, 1)
+            for _ in range(f1_sector_write):
+                write_sector_raw(drive, sector, expected, retries)
 
-    for sector in range(min_sector, max_sector):
-        print(f"Processing sector {sector}...")
-        attempts = 0
-        while attempts < f1_sector_attempts:
-            for pattern in patterns:
-                for _ in range(f1_sector_write):
-                    write_sector_raw(drive, sector, pattern, retries)
-
-            success = True
             for _ in range(f1_sector_read):
-                verified, latency = verify_sector(drive, sector, pattern, retries)
+                verified, latency = verify_sector(drive, sector, expected, retries)
                 if not verified or latency > max_latency:
                     success = False
                     break
+            if not success:
+                break
 
-            if success:
+        if success:
+            break
+        else:
+            attempts += 1
+    return success, attempts + 1 if success else attempts
+
+def f1_block(settings, drive, sector, count, patterns):
+    """Write and verify the patterns on a whole block, returns the sectors that failed.
+
+    Every pass writes the block in one request and reads it back in one request,
+    so the per-sector path is only needed for the sectors returned here.
+    """
+    f1_sector_write = settings['f1_sector_write']
+    f1_sector_read = settings['f1_sector_read']
+    max_latency = settings['max_latency']
+    retries = settings['error_use_handle']
+    block = list(range(sector, sector + count))
+
+    failed = set()
+    for pattern in patterns:
+        expected = pattern(sector, count)
+        for _ in range(f1_sector_write):
+            if not write_sectors_raw(drive, sector, expected, retries):
+                return block
+
+        for _ in range(f1_sector_read):
+            success, data, latency = read_sectors_raw(drive, sector, count, retries)
+            # A slow or failed block read can't be attributed to one sector
+            if not success or latency > max_latency:
+                return block
+            if data != expected:
+                failed.update(mismatched_sectors(data, expected, sector))
+    return sorted(failed)
+
+def run_pipeline(source, stages, sink):
+    """Run `source` and every stage in its own thread, feeding the results to `sink` on this thread.
+
+    `source` is an iterable, each stage maps one item to an iterable of items
+    for the next one, and `sink` consumes what the last stage produces. The
+    stages are joined by bounded queues, so a slow sink holds the source back
+    instead of piling up results, while short stalls (printing, file writes)
+    don't keep the drive waiting.
+
+    Ctrl+C or an exception in any stage only stops the source, after the
+    item it is working on. Everything it already produced still goes through
+    the other stages to the sink, since for the repair modes those are
+    sectors that have already been written. The exception is raised here
+    afterwards.
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(PIPELINE_QUEUE_SIZE) for _ in range(len(stages) + 1)]
+    errors = []
+
+    def fail(error):
+        errors.append(error)
+        stop.set()
+
+    def run_source():
+        items = iter(source)
+        try:
+            for item in items:
+                queues[0].put(item)
+                if stop.is_set():
+                    break
+        except BaseException as e:
+            fail(e)
+        finally:
+            try:
+                if hasattr(items, 'close'):
+                    items.close()  # Lets a generator source run its cleanup
+            except BaseException as e:
+                fail(e)
+            queues[0].put(PIPELINE_DONE)
+
+    def run_stage(stage, input_queue, output):
+        failed = False
+        while True:
+            item = input_queue.get()
+            if item is PIPELINE_DONE:
                 break
+            if failed:
+                continue  # Keep taking items so the stages before this one don't block
+            try:
+                for result in stage(item):
+                    output.put(result)
+            except BaseException as e:
+                fail(e)
+                failed = True
+        output.put(PIPELINE_DONE)
+
+    threads = [threading.Thread(target=run_source, daemon=True)]
+    threads += [threading.Thread(target=run_stage, args=(stage, queues[i], queues[i + 1]), daemon=True)
+                for i, stage in enumerate(stages)]
+    for thread in threads:
+        thread.start()
+
+    interrupt = None
+    item = None
+    while True:
+        try:
+            if item is None:
+                item = queues[-1].get(timeout=0.1)  # With a timeout, so Ctrl+C gets through on Windows
+            if item is PIPELINE_DONE:
+                break
+            sink(item)
+            item = None
+        except queue.Empty:
+            continue
+        except BaseException as e:
+            if interrupt is None and not errors:
+                print("Stopping after the current sector, the results already done are still logged...")
+            if interrupt is None:
+                interrupt = e
+                stop.set()
+            if not isinstance(e, KeyboardInterrupt):
+                item = None  # The sink failed on this item, go on with the next one
+    for thread in threads:
+        thread.join()
+    if interrupt is not None:
+        raise interrupt
+    if errors:
+        raise errors[0]
+
+class ResultSink:
+    """Last pipeline stage of the repair modes: prints messages and appends lines to the recovered sectors file.
+
+    The file stays open for the whole run and is flushed every second
+    instead of being reopened for every sector.
+    """
+
+    def __init__(self):
+        self.file = open(recovered_sectors_file, 'a')
+        self.last_flush = time.time()
+
+    def __call__(self, item):
+        message, line = item
+        if message:
+            print(message)
+        if line:
+            self.file.write(line)
+            if time.time() - self.last_flush >= 1:
+                self.last_flush = time.time()
+                self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def log_results(settings, results, writes, reads, max_attempts):
+    """Print and log the SectorResults of a repair engine through the I/O, analysis and sink pipeline.
+
+    `writes`, `reads` and `max_attempts` fill the settings columns of the log.
+    Good first reads and all repairs are logged; slow and unreadable first
+    reads are only printed, their repair follows.
+    """
+    max_latency = settings['max_latency']
+
+    def analyse(result):
+        """Analysis stage: turns engine records into (message, log line) pairs."""
+        if result.phase == 'read':
+            message = f"Processing sector {result.sector}..."
+            if result.status == '!':
+                message += f"\nSector {result.sector} access time {result.latency:.2f}ms exceeds max latency {max_latency}ms"
+            if result.status != '+':
+                return [(message, None)]
+            return [(message, f"{result.sector} | + | 0 | {writes} | {reads} | {max_attempts} | *\n")]
+        success = result.status == '+'
+        plural = 's' if result.attempts != 1 else ''
+        message = None
+        if not success:
+            message = f"Sector {result.sector} could not be repaired after {result.attempts} attempt{plural}"
+        elif result.attempts:
+            message = f"Sector {result.sector} repaired in {result.attempts} attempt{plural}"
+        notes = '*' if success else '.'
+        if result.note:
+            message = f"{message} ({result.note})" if message else f"Sector {result.sector}: {result.note}"
+            notes += f" {result.note}"
+        return [(message, f"{result.sector} | {result.status} | {result.attempts} | {writes} | {reads} | {max_attempts} | {notes}\n")]
+
+    sink = ResultSink()
+    try:
+        run_pipeline(results, [analyse], sink)
+    finally:
+        sink.close()
+
+def f1_results(settings, drive, patterns):
+    """F1 engine: yields a 'repair' SectorResult for every sector in the range."""
+    min_sector = settings['min_sector']
+    max_sector = settings['max_sector'] or (128 * 1024 * 1024) // SECTOR_SIZE
+    block_sectors = max(1, settings['f1_block_sectors'])
+
+    for block_start in range(min_sector, max_sector, block_sectors):
+        count = min(block_sectors, max_sector - block_start)
+        failed = set(f1_block(settings, drive, block_start, count, patterns)) if count > 1 else {block_start}
+        for sector in range(block_start, block_start + count):
+            if sector in failed:
+                success, attempts = f1_sector(settings, drive, sector, patterns)
             else:
-                attempts += 1
+                success, attempts = True, 0
+            yield SectorResult(sector, 'repair', '+' if success else '-', attempts, None, None)
+        report_progress(block_start + count - min_sector, max_sector - min_sector)
 
-        with open(recovered_sectors_file, 'a') as f:
-            status = "+" if success else "-"
-            f.write(f"{sector} | {status} | {attempts} | {f1_sector_write * 2} | {f1_sector_read} | {f1_sector_attempts} | {'*' if success else '.'}\n")
+def f1_mode(settings, drive):
+    print(f"Running f1 mode on drive {drive}...")
+    patterns = get_patterns(settings)
+    log_results(settings, f1_results(settings, drive, patterns),
+                settings['f1_sector_write'] * len(patterns), settings['f1_sector_read'], settings['f1_sector_attempts'])
 
-def recovery_mode(settings, drive):
-    print(f"Running recovery mode on drive {drive}...")
-    patterns = [b'\x55', b'\xAA']  # Binary patterns
+def recovery_results(settings, drive, patterns):
+    """Recovery engine: yields a 'read' SectorResult for every sector and a 'repair' one for every suspect.
 
+    Slow and unreadable sectors are held back while they are adjacent, so a
+    run of them is repaired together; their 'repair' records follow the
+    'read' records of the whole run.
+    """
     min_sector = settings['min_sector']
-    max_sector = settings['max_sector']
-    repair_sector_write = settings['repair_sector_write']
-    repair_sector_read = settings['repair_sector_read']
-    repair_sector_attempts = settings['repair_sector_attempts']
+    max_sector = settings['max_sector'] or (128 * 1024 * 1024) // SECTOR_SIZE
     max_latency = settings['max_latency']
     retries = settings['error_use_handle']
+    block_sectors = max(1, settings['repair_block_sectors'])
+    suspects = []  # Run of adjacent sectors waiting for repair
+    layout = load_track_layout(get_drive_serial(drive)) if settings['neighbour_scan'] and not settings['track_sectors'] else None
+    scheduler = DefectScheduler(settings, min_sector, max_sector, layout)
 
-    if max_sector == 0:
-        max_sector = (128 * 1024 * 1024) // SECTOR_SIZE
+    def repair_suspects():
+        results = repair_range(settings, drive, suspects[0], len(suspects), patterns, verbose=False)
+        for suspect in suspects:
+            success, attempts, note = results[suspect]
+            yield SectorResult(suspect, 'repair', '+' if success else '-', attempts, None, note)
+        suspects.clear()
 
-    for sector in range(min_sector, max_sector):
-        print(f"Processing sector {sector}...")
+    for processed, sector in enumerate(scheduler, start=1):
+        report_progress(processed, max_sector - min_sector)
         # First attempt to read the sector
         success, data, latency = read_sector_raw(drive, sector, retries)
         if success and latency <= max_latency:
             # Sector read successfully within allowed latency, no repair needed
-            status = "+"
-            attempts = 0
+            if suspects:
+                yield from repair_suspects()
+            yield SectorResult(sector, 'read', '+', 0, latency, None)
         else:
-            if latency is not None and latency > max_latency:
-                print(f"Sector {sector} access time {latency:.2f}ms exceeds max latency {max_latency}ms")
-            # Sector read failed or exceeded max latency, perform repair attempts
-            success, attempts = repair_sector(settings, drive, sector, patterns)
+            # Sector read failed or exceeded max latency, queue it so adjacent bad sectors are repaired together
+            scheduler.report_defect(sector)
+            if suspects and (sector != suspects[-1] + 1 or len(suspects) >= block_sectors):
+                yield from repair_suspects()
+            suspects.append(sector)
+            yield SectorResult(sector, 'read', '-' if latency is None else '!', 0, latency, None)
+    if suspects:
+        yield from repair_suspects()
 
-        with open(recovered_sectors_file, 'a') as f:
-            status = "+" if success else "-"
-            f.write(f"{sector} | {status} | {attempts} | {repair_sector_write * 2} | {repair_sector_read} | {repair_sector_attempts} | {'*' if success else '.'}\n")
+def recovery_mode(settings, drive):
+    print(f"Running recovery mode on drive {drive}...")
+    patterns = get_patterns(settings)
+    log_results(settings, recovery_results(settings, drive, patterns),
+                settings['repair_sector_write'] * len(patterns), settings['repair_sector_read'], settings['repair_sector_attempts'])
+
+def regenerator_results(settings, drive, patterns):
+    """Regenerator engine: repairs every sector in the range, yields a 'repair' SectorResult for each."""
+    min_sector = settings['min_sector']
+    max_sector = settings['max_sector'] or (128 * 1024 * 1024) // SECTOR_SIZE
+    for sector in range(min_sector, max_sector):
+        success, attempts, note = repair_sector(settings, drive, sector, patterns, verbose=False)
+        yield SectorResult(sector, 'repair', '+' if success else '-', attempts, None, note)
+        report_progress(sector + 1 - min_sector, max_sector - min_sector)
 
 def regenerator_mode(settings, drive):
     print(f"Running regenerator mode on drive {drive}...")
-    patterns = [b'\x55', b'\xAA']  # Binary patterns
+    patterns = get_patterns(settings)
+    log_results(settings, regenerator_results(settings, drive, patterns),
+                settings['regenerator_sector_write'] * len(patterns), settings['regenerator_sector_read'], settings['regenerator_sector_attempts'])
 
-    min_sector = settings['min_sector']
-    max_sector = settings['max_sector']
-    regenerator_sector_write = settings['regenerator_sector_write']
-    regenerator_sector_read = settings['regenerator_sector_read']
-    regenerator_sector_attempts = settings['regenerator_sector_attempts']
-    max_latency = settings['max_latency']
-    retries = settings['error_use_handle']
+def log_record(groups):
+    """LogRecord of the groups of a LOG_LINE_PATTERN match.
 
-    if max_sector == 0:
-        max_sector = (128 * 1024 * 1024) // SECTOR_SIZE
+    Both the current 7 column format (sector | status | attempts | writes | reads |
+    max attempts | notes) and the 8 column VTC16.8 format (sector | status |
+    attempts | 8 | latency | time spent | error type | notes) are accepted.
+    """
+    sector, status, attempts, fifth, eight_columns = groups
+    attempts = attempts.strip()
+    latency = None
+    if eight_columns:
+        try:
+            latency = float(fifth)
+        except ValueError:
+            pass  # '-' for sectors that were not repaired
+    return LogRecord(
+        int(sector),
+        status.decode('ascii', 'replace'),
+        int(attempts) if attempts.isdigit() else None,
+        latency,
+    )
 
-    for sector in range(min_sector, max_sector):
-        print(f"Processing sector {sector}...")
-        success, attempts = repair_sector(settings, drive, sector, patterns)
-        with open(recovered_sectors_file, 'a') as f:
-            status = "+" if success else "-"
-            f.write(f"{sector} | {status} | {attempts} | {regenerator_sector_write * 2} | {regenerator_sector_read} | {regenerator_sector_attempts} | {'*' if success else '.'}\n")
+def read_log_chunks(path=None, chunk_size=LOG_CHUNK_SIZE):
+    """Yield the log in binary chunks that always end on a line boundary."""
+    with open(path or recovered_sectors_file, 'rb') as f:
+        tail = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            chunk = tail + chunk
+            cut = chunk.rfind(b'\n') + 1
+            tail = chunk[cut:]
+            yield chunk[:cut]
+        if tail:
+            yield tail + b'\n'
+
+def iter_log_records(path=None):
+    """Yield a LogRecord for every valid line of the log without loading the whole file."""
+    for chunk in read_log_chunks(path):
+        # One regex scan over the chunk is much faster than splitting every line; headers and
+        # lines with fewer than 7 columns don't match
+        for groups in LOG_LINE_PATTERN.findall(chunk):
+            yield log_record(groups)
+
+def latest_sector_states(path=None, include_good=False):
+    """Return {sector: LogRecord} holding the latest entry of every sector in the log.
+
+    Sectors whose latest status is '+' are left out unless include_good is set,
+    so memory only grows with the number of problem sectors, not with the log.
+    """
+    states = {}
+    for record in iter_log_records(path):
+        if record.status == '+' and not include_good:
+            states.pop(record.sector, None)
+        else:
+            states[record.sector] = record
+    return states
+
+def coalesce_sectors(sectors, max_count):
+    """Group sorted sectors into (start, count) runs of adjacent sectors."""
+    start = count = None
+    for sector in sectors:
+        if start is not None and sector == start + count and count < max_count:
+            count += 1
+            continue
+        if start is not None:
+            yield start, count
+        start, count = sector, 1
+    if start is not None:
+        yield start, count
+
+def workout_results(settings, drive, patterns, targets):
+    """Workout engine: repairs the sorted `targets` in runs of adjacent sectors, yields a 'repair' SectorResult for each."""
+    block_sectors = max(1, settings['repair_block_sectors'])
+    done = 0
+    for start, count in coalesce_sectors(targets, block_sectors):
+        results = repair_range(settings, drive, start, count, patterns, verbose=False)
+        for sector in range(start, start + count):
+            success, attempts, note = results[sector]
+            yield SectorResult(sector, 'repair', '+' if success else '-', attempts, None, note)
+        done += count
+        report_progress(done, len(targets))
 
 def workout_mode(settings, drive):
     if not os.path.exists(recovered_sectors_file):
@@ -309,61 +1754,1057 @@ def workout_mode(settings, drive):
     test_unstable = input("Do you want to test unstable sectors again? (y/n): ").lower() == 'y'
 
     print(f"Workout mode on drive {drive}...")
+    patterns = get_patterns(settings)
 
-    with open(recovered_sectors_file, 'r') as f:
-        for line in f:
-            parts = line.split("|")
-            if len(parts) < 7 or not parts[0].strip().isdigit():
-                continue  # Skip header or invalid lines
+    # The log holds one line per sector per run, the latest line is the current state
+    latest = latest_sector_states()
 
-            sector = int(parts[0].strip())
-            status = parts[1].strip()
-            if status == "-" or (test_unstable and status == "!"):
-                repair_sector(settings, drive, sector, [b'\x55', b'\xAA'])
+    # One ascending sweep over the targets instead of seeking back and forth in file order
+    targets = sorted(sector for sector, record in latest.items() if record.status == "-" or (test_unstable and record.status == "!"))
+    print(f"{len(targets)} sectors to work out.")
+    log_results(settings, workout_results(settings, drive, patterns, targets),
+                settings['repair_sector_write'] * len(patterns), settings['repair_sector_read'], settings['repair_sector_attempts'])
 
-def main():
-    settings = read_settings()
+def run_sequential_reads(handles, first, count, block_sectors, queue_depth):
+    """Read `count` sectors from `first` in blocks with `queue_depth` reads in flight.
+
+    Returns (sorted latencies in ms, errors, elapsed seconds).
+    """
+    blocks = iter(range(first, first + count, block_sectors))
+    end = first + count
+
+    def worker():
+        handle, buffer = handles.get()
+        latencies = []
+        errors = 0
+        for sector in blocks:  # Shared iterator, every block is read by one worker
+            try:
+                latencies.append(read_block(handle, sector, min(block_sectors, end - sector), buffer))
+            except OSError:
+                errors += 1
+        return latencies, errors
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=queue_depth) as executor:
+        results = [future.result() for future in [executor.submit(worker) for _ in range(queue_depth)]]
+    elapsed = time.perf_counter() - start_time
+    latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+    return latencies, sum(errors for _, errors in results), elapsed
+
+class AutoTuner:
+    """Block size and queue depth for the check mode, picked per zone by a short probe.
+
+    The first block the scan reaches in each of auto_tune_zones zones triggers a
+    probe: every combination of auto_tune_block_sectors and auto_tune_queue_depths
+    reads auto_tune_sample_mib sequentially from there, and the fastest one whose
+    p99 stays within max_latency is used for the zone. Inner zones are slower,
+    so the best combination drifts over the drive. An empty or invalid list
+    falls back to the check mode's own (block sectors, queue depth) `default`.
+    """
+
+    def __init__(self, settings, drive, min_sector, max_sector, default):
+        self.settings = settings
+        self.drive = drive
+        self.min_sector = min_sector
+        self.max_sector = max_sector
+        self.block_sizes = parse_positive_list(settings['auto_tune_block_sectors'])
+        self.queue_depths = parse_positive_list(settings['auto_tune_queue_depths'])
+        if not self.block_sizes:
+            print(f"No valid block size in auto_tune_block_sectors, auto-tuning with {default[0]} sectors only.")
+            self.block_sizes = [default[0]]
+        if not self.queue_depths:
+            print(f"No valid queue depth in auto_tune_queue_depths, auto-tuning with queue depth {default[1]} only.")
+            self.queue_depths = [default[1]]
+        self.zones = max(1, min(settings['auto_tune_zones'], max_sector - min_sector))
+        self.tuned = {}
+
+    def zone(self, sector):
+        return (sector - self.min_sector) * self.zones // (self.max_sector - self.min_sector)
+
+    def needs_tuning(self, sector):
+        return self.zone(sector) not in self.tuned
+
+    def tune(self, sector, default):
+        """Probe the grid from `sector` and return the (block sectors, queue depth) chosen for its zone."""
+        zone = self.zone(sector)
+        zone_end = self.min_sector + -(-(zone + 1) * (self.max_sector - self.min_sector) // self.zones)
+        sample = max(1, self.settings['auto_tune_sample_mib'] * 1024 * 1024 // SECTOR_SIZE)
+        handles = ReadOnlyHandles(self.drive, max(self.block_sizes))
+        cells = []
+        offset = sector
+        try:
+            for block_sectors in self.block_sizes:
+                for queue_depth in self.queue_depths:
+                    # Every combination reads fresh sectors, so the drive cache doesn't flatter the later ones
+                    if zone_end - offset < min(sample, zone_end - sector):
+                        offset = sector
+                    count = min(sample, zone_end - offset)
+                    latencies, errors, elapsed = run_sequential_reads(handles, offset, count, block_sectors, queue_depth)
+                    offset += count
+                    cells.append(engine_cell(block_sectors * SECTOR_SIZE, queue_depth, latencies, errors, elapsed))
+        finally:
+            handles.close()
+
+        best = best_engine_config(cells, self.settings['max_latency'])
+        if best and best['mb_per_s'] > 0:
+            self.tuned[zone] = (best['block_size'] // SECTOR_SIZE, best['queue_depth'])
+            print(f"Zone {zone + 1}/{self.zones}: {self.tuned[zone][0]} sectors per block, queue depth {self.tuned[zone][1]} "
+                  f"({best['mb_per_s']:.1f} MB/s, p99 {best['p99']:.2f}ms)")
+        else:
+            self.tuned[zone] = default
+            print(f"Zone {zone + 1}/{self.zones}: no usable probe reads, keeping {default[0]} sectors per block, queue depth {default[1]}")
+        return self.tuned[zone]
+
+def check_block(settings, handles, sector, count, pause=None, policy=None):
+    """Read a block on this thread's handle, returns (block latency, [(sector, status, latency)]).
+
+    The per-sector list is only filled when the block read failed or was slow,
+    status is '+' good, '!' slow or '-' unreadable. `pause` is called before
+    each of those per-sector reads, e.g. to wait while the drive is busy.
+    `policy` is the RetryPolicy of the reads, see run_with_retry().
+    """
+    max_latency = settings['max_latency']
+    retries = settings['error_use_handle']
+    handle, buffer = handles.get()
+
+    try:
+        latency = run_with_retry(lambda: read_block(handle, sector, count, buffer), f"reading sector {sector}", retries, policy)
+        if latency <= max_latency:
+            return latency, None
+    except OSError:
+        latency = None
+
+    sectors = []
+    for s in range(sector, sector + count):
+        if pause:
+            pause()
+        try:
+            sector_latency = run_with_retry(lambda: read_block(handle, s, 1, buffer), f"reading sector {s}", retries, policy)
+        except OSError:
+            sectors.append((s, '-', None))
+            continue
+        sectors.append((s, '+' if sector_latency <= max_latency else '!', sector_latency))
+    return latency, sectors
+
+def check_engine(settings, drive):
+    """Return (block sectors, queue depth) of the read-only check.
+
+    A setting of 0 takes the suggestion of the random read benchmark from the
+    drive profile, or 256 sectors at queue depth 4 if the drive wasn't benchmarked.
+    """
+    block_sectors = settings['check_block_sectors']
+    queue_depth = settings['check_queue_depth']
+    if block_sectors <= 0 or queue_depth <= 0:
+        profile = load_drive_profile(get_drive_serial(drive))
+        if block_sectors <= 0:
+            block_sectors = int(profile.get('suggested_block_sectors', 256))
+        if queue_depth <= 0:
+            queue_depth = int(profile.get('suggested_queue_depth', 4))
+    return max(1, block_sectors), max(1, queue_depth)
+
+def check_mode(settings, drive):
+    """Read-only surface scan: no writes to the drive, shared access, cached data bypassed."""
+    print(f"Running read-only check on drive {drive}...")
+    sector_range = scan_range(settings, drive)
+    if not sector_range:
+        return
+    min_sector, max_sector = sector_range
+    block_sectors, queue_depth = check_engine(settings, drive)
+    print(f"Reading blocks of {block_sectors} sectors, queue depth {queue_depth}.")
+
+    layout = load_track_layout(get_drive_serial(drive)) if settings['track_align'] else None
+    if settings['track_align'] and not layout:
+        print("No track layout for this drive, run the track calibration mode first. Reading unaligned blocks.")
+    tuner = AutoTuner(settings, drive, min_sector, max_sector, (block_sectors, queue_depth)) if settings['auto_tune'] else None
+    handles = ReadOnlyHandles(drive, max([block_sectors] + (tuner.block_sizes if tuner else [])))
+    heatmap = Heatmap(min_sector, max_sector, settings['heatmap_cells'])
+    total = max_sector - min_sector
+
+    block_stats = LatencyStats()
+    sector_stats = LatencyStats()
+    counts = {'+': 0, '!': 0, '-': 0}
+    run = None  # [first sector, last sector, status] of the status map line being built
+    start_time = last_report = time.time()
+    pending = deque()
+
+    # Auto-tuned queue depths change per zone, so the pool is sized for the largest one and
+    # the number of blocks in flight is limited instead; the executor queue then stays empty
+    workers = max([queue_depth] + tuner.queue_depths) if tuner else queue_depth
+    with open(status_map_file, 'w') as status_map, ThreadPoolExecutor(max_workers=workers) as executor:
+        status_map.write(f"# {drive} sectors {min_sector}-{max_sector - 1}, {settings['scan_order']} order\nFirst | Last | Status\n")
+
+        def mark(first, last, status):
+            nonlocal run
+            counts[status] += last - first + 1
+            heatmap.add(first, last - first + 1, status)
+            if run and run[2] == status and run[1] + 1 == first:
+                run[1] = last
+                return
+            if run:
+                status_map.write(f"{run[0]} | {run[1]} | {run[2]}\n")
+            run = [first, last, status]
+
+        def consume():
+            nonlocal last_report
+            sector, count, future = pending.popleft()
+            latency, sectors = future.result()
+            if latency is not None:
+                block_stats.add(latency)
+            if sectors is None:
+                mark(sector, sector + count - 1, '+')
+            else:
+                problems = []
+                for s, status, sector_latency in sectors:
+                    if sector_latency is not None:
+                        sector_stats.add(sector_latency)
+                    mark(s, s, status)
+                    if status != '+':
+                        problems.append(f"{s} | {status} | 0 | 0 | 1 | 0 | {f'{sector_latency:.2f}ms' if sector_latency is not None else 'read error'}\n")
+                if problems:
+                    with open(recovered_sectors_file, 'a') as f:
+                        f.writelines(problems)
+            report_progress(sum(counts.values()), total)
+
+            if time.time() - last_report >= 5:
+                last_report = time.time()
+                done = sum(counts.values())
+                speed = done * SECTOR_SIZE / (last_report - start_time) / (1024 * 1024)
+                print(f"Checked {done}/{total} sectors ({100 * done / total:.1f}%), {speed:.1f} MB/s, {counts['!']} slow, {counts['-']} bad")
+
+        def read_blocks():
+            nonlocal block_sectors, queue_depth
+            for chunk_start, chunk_count in scan_order(settings, min_sector, max_sector):
+                if tuner:
+                    if tuner.needs_tuning(chunk_start):
+                        # The probe needs the drive to itself, so the blocks in flight are finished first
+                        while pending:
+                            consume()
+                        block_sectors, queue_depth = tuner.tune(chunk_start, (block_sectors, queue_depth))
+                    else:
+                        block_sectors, queue_depth = tuner.tuned[tuner.zone(chunk_start)]
+                # Without a layout this just cuts the chunk into blocks of block_sectors
+                yield from split_at_tracks(layout, chunk_start, chunk_count, block_sectors)
+
+        # Results are consumed in scan order while up to 2 x queue depth blocks are in flight
+        blocks = read_blocks()
+        try:
+            while True:
+                while len(pending) < (queue_depth if tuner else queue_depth * 2):
+                    sector, count = next(blocks, (None, None))
+                    if sector is None:
+                        break
+                    pending.append((sector, count, executor.submit(check_block, settings, handles, sector, count)))
+                if not pending:
+                    break
+                consume()
+        finally:
+            for future in (future for _, _, future in pending):
+                future.cancel()
+            if run:
+                status_map.write(f"{run[0]} | {run[1]} | {run[2]}\n")
+            # Also written when the check is interrupted, a partial progressive run is still a usable picture
+            heatmap.write(heatmap_file)
+
+    handles.close()
+
+    elapsed = time.time() - start_time
+    print(f"Check finished in {elapsed:.1f}s, {total * SECTOR_SIZE / max(elapsed, 0.001) / (1024 * 1024):.1f} MB/s")
+    print(f"Good: {counts['+']}, slow: {counts['!']}, unreadable: {counts['-']} (status map in '{status_map_file}', heatmap in '{heatmap_file}')")
+    print(f"Block reads: {block_stats.summary()}")
+    if sector_stats.count:
+        print(f"Single sector reads: {sector_stats.summary()}")
+
+async def async_scan(drive, **overrides):
+    """Read-only scan of `drive` as an async iterator of ScanResult, one per block in scan order.
+
+    For use as a library: the settings come from settings.ini (or the
+    defaults), keyword arguments override them, e.g.
+    async_scan(drive, max_sector=2048, check_queue_depth=8). The reads run on
+    a thread pool with check_queue_depth reads in flight. Cancelling the
+    consuming task or closing the iterator stops the scan, waits for the
+    reads in flight and closes the drive handles; use contextlib.aclosing()
+    to have that happen right away when the consumer stops early. Errors
+    opening the drive or reading its size are raised as OSError.
+    """
+    settings = dict(read_settings(), **overrides)
+    policy = retry_policy(settings)  # Per scan, other scans in the process may use other settings
+    loop = asyncio.get_running_loop()
+    min_sector = settings['min_sector']
+    max_sector = settings['max_sector'] or await loop.run_in_executor(None, get_drive_sectors, drive)
+    layout = await loop.run_in_executor(None, lambda: load_track_layout(get_drive_serial(drive))) if settings['track_align'] else None
+    block_sectors, queue_depth = await loop.run_in_executor(None, check_engine, settings, drive)
+
+    blocks = (block for chunk_start, chunk_count in scan_order(settings, min_sector, max_sector)
+              for block in split_at_tracks(layout, chunk_start, chunk_count, block_sectors))
+    handles = ReadOnlyHandles(drive, block_sectors)
+    executor = ThreadPoolExecutor(max_workers=queue_depth)
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < queue_depth * 2:
+                sector, count = next(blocks, (None, None))
+                if sector is None:
+                    break
+                pending.append((sector, count, loop.run_in_executor(executor, check_block, settings, handles, sector, count, None, policy)))
+            if not pending:
+                break
+            sector, count, future = pending[0]
+            latency, sectors = await future
+            pending.popleft()
+            yield ScanResult(sector, count, latency, sectors)
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+        try:
+            # Reads already running can't be interrupted, the handles are closed once they are done
+            await loop.run_in_executor(None, executor.shutdown)
+        finally:
+            # Unless this cleanup is cancelled too (e.g. the event loop shutting down), then right away
+            handles.close()
 
-    # Initialize the recovered sectors file with a title line
+def wilson_interval(hits, samples, z=1.96):
+    """95% confidence interval of a proportion (Wilson score), works for 0 hits too."""
+    if not samples:
+        return 0.0, 1.0
+    p = hits / samples
+    denominator = 1 + z * z / samples
+    centre = (p + z * z / (2 * samples)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / samples + z * z / (4 * samples * samples)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+def sample_sector(settings, handles, sector):
+    """Read one sector, returns (sector, status, latency)."""
+    handle, buffer = handles.get()
+    try:
+        latency = run_with_retry(lambda: read_block(handle, sector, 1, buffer), f"reading sector {sector}", settings['error_use_handle'])
+    except OSError:
+        return sector, '-', None
+    return sector, '+' if latency <= settings['max_latency'] else '!', latency
+
+def sampling_mode(settings, drive):
+    """Estimate bad and slow sector density per zone from a stratified random sample."""
+    print(f"Running sampling mode on drive {drive}...")
+    sector_range = scan_range(settings, drive)
+    if not sector_range:
+        return
+    min_sector, max_sector = sector_range
+    zones = max(1, min(settings['sample_zones'], max_sector - min_sector))
+    sample_count = settings['sample_count']
+    deadline = time.time() + settings['sample_time_budget']
+    _, queue_depth = check_engine(settings, drive)
+    zone_size = (max_sector - min_sector) / zones
+    bounds = [(min_sector + int(i * zone_size), min_sector + int((i + 1) * zone_size)) for i in range(zones)]
+
+    samples = [0] * zones
+    bad = [0] * zones
+    slow = [0] * zones
+    stats = LatencyStats()
+    handles = ReadOnlyHandles(drive, 1)
+    taken = 0
+
+    # Every round takes one sample per zone, so stopping at the deadline keeps the sample stratified
+    with ThreadPoolExecutor(max_workers=queue_depth) as executor:
+        while taken < sample_count and time.time() < deadline:
+            round_zones = range(min(zones, sample_count - taken))
+            futures = [(zone, executor.submit(sample_sector, settings, handles, random.randrange(*bounds[zone]))) for zone in round_zones]
+            problems = []
+            for zone, future in futures:
+                sector, status, latency = future.result()
+                samples[zone] += 1
+                if latency is not None:
+                    stats.add(latency)
+                if status == '-':
+                    bad[zone] += 1
+                elif status == '!':
+                    slow[zone] += 1
+                if status != '+':
+                    problems.append(f"{sector} | {status} | 0 | 0 | 1 | 0 | {f'{latency:.2f}ms' if latency is not None else 'read error'}\n")
+            taken += len(futures)
+            report_progress(taken, sample_count)
+            if problems:
+                with open(recovered_sectors_file, 'a') as f:
+                    f.writelines(problems)
+    handles.close()
+
+    print(f"{taken} samples over {zones} zones, {stats.summary()}")
+    flagged = []
+    with open(sampling_report_file, 'w') as report:
+        report.write("zone,first_sector,last_sector,samples,bad,slow,bad_density,bad_low,bad_high,slow_density,slow_low,slow_high,estimated_bad_sectors\n")
+        for zone, (first, end) in enumerate(bounds):
+            n = samples[zone]
+            bad_low, bad_high = wilson_interval(bad[zone], n)
+            slow_low, slow_high = wilson_interval(slow[zone], n)
+            bad_density = bad[zone] / n if n else 0.0
+            slow_density = slow[zone] / n if n else 0.0
+            report.write(f"{zone},{first},{end - 1},{n},{bad[zone]},{slow[zone]},{bad_density:.6f},{bad_low:.6f},{bad_high:.6f},"
+                         f"{slow_density:.6f},{slow_low:.6f},{slow_high:.6f},{int(bad_density * (end - first))}\n")
+            if bad[zone] or slow[zone]:
+                flagged.append((zone, first, end - 1, bad_density, bad_high, slow_density, slow_high))
+
+    print(f"Per-zone estimates written to '{sampling_report_file}'.")
+    if not flagged:
+        upper = wilson_interval(0, min(samples))[1] if taken else 1.0
+        print(f"No bad or slow samples, density below {upper * 100:.3f}% per zone (95% confidence).")
+        return
+    print("Zones that deserve a full scan (set min_sector/max_sector to these ranges):")
+    for zone, first, last, bad_density, bad_high, slow_density, slow_high in flagged:
+        print(f"  zone {zone}: sectors {first}-{last}, bad {bad_density * 100:.3f}% (<= {bad_high * 100:.3f}%), slow {slow_density * 100:.3f}% (<= {slow_high * 100:.3f}%)")
+
+def probe_rotation(handle, buffer, sector, offset, repeats):
+    """Median latency of reading `sector - offset` right after `sector`.
+
+    Reading backwards keeps the drive's read-ahead cache out of the measurement:
+    the head has to wait until the earlier sector comes round again. Failed
+    repeats are left out, the last error is raised if none succeeded.
+    """
+    samples = []
+    for _ in range(repeats):
+        try:
+            read_block(handle, sector, 1, buffer)
+            samples.append(read_block(handle, sector - offset, 1, buffer))
+        except OSError as e:
+            error = e
+    if not samples:
+        raise error
+    return sorted(samples)[len(samples) // 2]
+
+def estimate_track(handle, buffer, sector, settings):
+    """Estimate (sectors per track, track start, revolution ms) around `sector`, None if unclear.
+
+    The track start is None if no track skew stands out.
+
+    The latency of the backward probe falls linearly with the offset (the
+    target is closer to the head) and jumps up by one revolution when the
+    offset passes one track. Sectors per track = revolution / slope, which is
+    not biased by the command overhead like the jump position is. A second,
+    smaller jump where the probe crosses into the previous track (track skew)
+    gives the track start.
+    """
+    step = max(1, settings['calibration_step'])
+    offsets = list(range(step, min(settings['calibration_max_offset'], sector) + 1, step))
+    if len(offsets) < 8:
+        return None
+    latencies = [probe_rotation(handle, buffer, sector, offset, settings['calibration_repeats']) for offset in offsets]
+    diffs = [b - a for a, b in zip(latencies, latencies[1:])]
+    typical = sorted(diffs)[len(diffs) // 2]
+    if typical >= 0:
+        return None  # No falling sawtooth, probably an SSD or a cache that can't be defeated
+    # The offsets span several tracks, the first jump of about one revolution is the wrap
+    highest = max(diffs)
+    if highest <= 0:
+        return None
+    wrap = next(i for i, d in enumerate(diffs) if d > highest / 2)
+    revolution = diffs[wrap] - typical
+    if not REVOLUTION_RANGE_MS[0] <= revolution <= REVOLUTION_RANGE_MS[1]:
+        return None
+    track_sectors = round(revolution / (-typical / step))
+    if track_sectors < 4 * step:
+        return None
+
+    # Track skew: the largest deviation from the slope before the wrap
+    deviations = sorted(abs(d - typical) for d in diffs)
+    spread = deviations[len(deviations) // 2] or 0.001
+    skew = max(range(wrap), key=lambda i: abs(diffs[i] - typical), default=None)
+    if skew is not None and abs(diffs[skew] - typical) > 5 * spread:
+        track_start = sector - offsets[skew]
+    else:
+        track_start = None  # Unknown phase, blocks are only sized to whole tracks
+    return track_sectors, track_start, revolution
+
+def track_calibration_mode(settings, drive):
+    """Estimate sectors per track for every zone and store the layout in the drive profile."""
+    print(f"Running track calibration on drive {drive}...")
+    sector_range = scan_range(settings, drive)
+    if not sector_range:
+        return
+    min_sector, max_sector = sector_range
+    zones = max(1, settings['calibration_zones'])
+    zone_size = (max_sector - min_sector) // zones
+    handle = open_read_only(drive)
+    buffer = aligned_buffer(SECTOR_SIZE)
+    values = {}
+    layout = []
+    try:
+        for zone in range(zones):
+            first = min_sector + zone * zone_size
+            # Probe in the middle of the zone, far enough in for the backward offsets
+            probe = min(max_sector - 1, first + zone_size // 2 + settings['calibration_max_offset'])
+            try:
+                result = estimate_track(handle, buffer, probe, settings)
+            except OSError as e:
+                print(f"Zone {zone} (sector {first}): read error near sector {probe} ({e}), skipped")
+                continue
+            if not result:
+                print(f"Zone {zone} (sector {first}): no rotational pattern found, skipped")
+                continue
+            track_sectors, track_start, revolution = result
+            print(f"Zone {zone} (sector {first}): ~{track_sectors} sectors per track, revolution {revolution:.2f}ms (~{60000 / revolution:.0f} RPM)")
+            # -1 stores an unknown track start
+            values[f'track_zone_{len(layout)}'] = f"{first},{track_sectors},{-1 if track_start is None else track_start}"
+            layout.append(first)
+    finally:
+        close_drive(handle)
+
+    if not layout:
+        print("Calibration failed, nothing stored.")
+        return
+    values['track_zones'] = len(layout)
+    save_drive_profile(get_drive_serial(drive), values)
+    print(f"Track layout of {len(layout)} zones stored in '{drive_profiles_file}'.")
+
+def read_pair(handle, buffer, position, target):
+    """Latency in ms of reading `target` right after `position`, None if either read fails."""
+    try:
+        read_block(handle, position, 1, buffer)
+        return read_block(handle, target, 1, buffer)
+    except OSError:
+        return None
+
+def collect_samples(sample, samples):
+    """Call sample() until it returned `samples` latencies, failed ones (None) are taken again.
+
+    Gives up after 3 times as many tries, so a failing drive returns fewer samples.
+    """
+    latencies = []
+    for _ in range(samples * 3):
+        if len(latencies) == samples:
+            break
+        latency = sample()
+        if latency is not None:
+            latencies.append(latency)
+    return latencies
+
+def measure_revolution(handle, buffer, sector, samples):
+    """Revolution time in ms from the spread of rotational latency at one spot, None if unclear.
+
+    Each sample reads `sector` and then a random sector up to 4096 sectors
+    before it, so there is hardly any seek and no read-ahead cache hit: the
+    latency is the command overhead plus a uniform share of one revolution.
+    """
+    latencies = collect_samples(lambda: read_pair(handle, buffer, sector, sector - random.randint(1, min(4096, sector))), samples)
+    if len(latencies) < samples // 2:
+        return None
+    latencies.sort()
+    # The 2nd to 98th percentile of a uniform spread covers 96% of it
+    revolution = (latencies[int(len(latencies) * 0.98)] - latencies[int(len(latencies) * 0.02)]) / 0.96
+    # Anything else is no rotation, e.g. an SSD or a cache that can't be defeated
+    return revolution if REVOLUTION_RANGE_MS[0] <= revolution <= REVOLUTION_RANGE_MS[1] else None
+
+def measure_seek(handle, buffer, first, last, distance, samples):
+    """Average latency in ms of reads alternating between sectors about `distance` apart, None if they keep failing."""
+    def sample():
+        start = random.randint(first, max(first, last - distance))
+        # Jitter the target so the rotational wait averages out instead of repeating the same angle
+        target = start + distance + random.randint(0, min(distance, 4096))
+        return read_pair(handle, buffer, start, min(last, target))
+
+    latencies = collect_samples(sample, samples)
+    return sum(latencies) / len(latencies) if len(latencies) >= samples // 2 else None
+
+def characterise_mode(settings, drive):
+    """Measure RPM, seek times and sequential throughput and store them in the drive profile."""
+    print(f"Running drive characterisation on drive {drive}...")
+    sector_range = scan_range(settings, drive)
+    if not sector_range:
+        return
+    min_sector, max_sector = sector_range
+    last = max_sector - 1
+    samples = max(10, settings['benchmark_seek_samples'])
+    block_sectors = 2048  # Throughput is measured with 1 MiB reads
+    handle = open_read_only(drive)
+    buffer = aligned_buffer(block_sectors * SECTOR_SIZE)
+    values = {}
+    try:
+        revolution = measure_revolution(handle, buffer, min_sector + (max_sector - min_sector) // 2, samples * 2)
+        if revolution is None:
+            print("No rotational latency found (not a spinning drive, a cache that can't be bypassed or too many read errors), nothing stored.")
+            return
+        values['revolution_ms'] = f"{revolution:.3f}"
+        values['rpm'] = round(60000 / revolution)
+        print(f"Revolution {revolution:.2f}ms, ~{values['rpm']} RPM")
+
+        # Seek latency minus the average rotational wait (half a revolution)
+        seek_curve = []
+        span = last - min_sector
+        distance = 1024
+        while distance < span:
+            seek = measure_seek(handle, buffer, min_sector, last, distance, samples)
+            if seek is not None:
+                seek_curve.append((distance, max(0.0, seek - revolution / 2)))
+            distance *= 4
+        full_stroke = collect_samples(lambda: read_pair(handle, buffer, min(last, min_sector + random.randint(0, 4096)),
+                                                        max(min_sector, last - random.randint(0, 4096))), samples)
+        average_seek = collect_samples(lambda: read_pair(handle, buffer, random.randint(min_sector, last), random.randint(min_sector, last)), samples)
+        if len(full_stroke) < samples // 2 or len(average_seek) < samples // 2:
+            print("Too many read errors to measure the seek times, nothing stored.")
+            return
+        full_stroke = max(0.0, sum(full_stroke) / len(full_stroke) - revolution / 2)
+        average_seek = max(0.0, sum(average_seek) / len(average_seek) - revolution / 2)
+        for distance, seek in seek_curve:
+            print(f"Seek over {distance} sectors: {seek:.2f}ms")
+        print(f"Average seek {average_seek:.2f}ms, full stroke {full_stroke:.2f}ms")
+        values['average_seek_ms'] = f"{average_seek:.3f}"
+        values['full_stroke_ms'] = f"{full_stroke:.3f}"
+        values['seek_curve'] = ",".join(f"{distance}:{seek:.3f}" for distance, seek in seek_curve)
+
+        zones = max(1, settings['benchmark_zones'])
+        # Never more than the range holds, so the reads stay below max_sector
+        blocks = min(max(1, settings['benchmark_throughput_mib'] * 1024 * 1024 // (block_sectors * SECTOR_SIZE)),
+                     (max_sector - min_sector) // block_sectors)
+        throughput = []
+        for zone in range(zones if blocks else 0):
+            start = min_sector + (max_sector - min_sector - blocks * block_sectors) * zone // max(1, zones - 1)
+            try:
+                elapsed = 0.0
+                for block in range(blocks):
+                    elapsed += read_block(handle, start + block * block_sectors, block_sectors, buffer)
+            except OSError as e:
+                print(f"Error reading at sector {start}: {e}")
+                continue
+            speed = blocks * block_sectors * SECTOR_SIZE / (1024 * 1024) / (elapsed / 1000)
+            throughput.append((start, speed))
+            print(f"Sequential read at sector {start}: {speed:.1f} MB/s")
+        values['throughput'] = ",".join(f"{start}:{speed:.1f}" for start, speed in throughput)
+    finally:
+        close_drive(handle)
+
+    save_drive_profile(get_drive_serial(drive), values)
+    print(f"Drive profile stored in '{drive_profiles_file}', "
+          f"suggested max_latency {profile_max_latency(values, settings['latency_margin'])}ms")
+
+def profile_max_latency(profile, margin):
+    """Worst healthy access time: full stroke seek + one revolution + margin, None without a profile."""
+    if 'full_stroke_ms' not in profile or 'revolution_ms' not in profile:
+        return None
+    return math.ceil(float(profile['full_stroke_ms']) + float(profile['revolution_ms']) + margin)
+
+def sweep_mode(settings, drive):
+    """Sequential read throughput at evenly spaced points plus a random access time scatter."""
+    print(f"Running throughput sweep on drive {drive}...")
+    sector_range = scan_range(settings, drive)
+    if not sector_range:
+        return
+    min_sector, max_sector = sector_range
+    points = max(2, settings['sweep_points'])
+    block_sectors = 2048  # 1 MiB reads
+    blocks = max(1, settings['sweep_read_mib'])
+    span = max_sector - min_sector - blocks * block_sectors
+    if span < 0:
+        print("Scan range is smaller than one sweep read.")
+        return
+    handle = open_read_only(drive)
+    buffer = aligned_buffer(block_sectors * SECTOR_SIZE)
+    speeds = []
+    access_stats = LatencyStats()
+    last_report = time.time()
+    try:
+        with open(sweep_report_file, 'w') as report:
+            report.write("point,sector,mb_per_s,access_sector,access_ms\n")
+            for point in range(points):
+                start = min_sector + span * point // (points - 1)
+                try:
+                    # The first sector positions the head, so the seek is not counted as transfer time
+                    read_block(handle, start, 1, buffer)
+                    start_time = time.perf_counter()
+                    for block in range(blocks):
+                        read_block(handle, start + block * block_sectors, block_sectors, buffer)
+                    speed = blocks * block_sectors * SECTOR_SIZE / (1024 * 1024) / (time.perf_counter() - start_time)
+                except OSError as e:
+                    print(f"Error reading at sector {start}: {e}")
+                    speed = 0.0
+                access_sector = random.randrange(min_sector, max_sector)
+                try:
+                    access = read_block(handle, access_sector, 1, buffer)
+                    access_stats.add(access)
+                except OSError:
+                    access = None
+                speeds.append((start, speed))
+                report_progress(point + 1, points)
+                report.write(f"{point},{start},{speed:.1f},{access_sector},{f'{access:.2f}' if access is not None else ''}\n")
+                if time.time() - last_report >= 5:
+                    last_report = time.time()
+                    print(f"Point {point + 1}/{points}: {speed:.1f} MB/s at sector {start}")
+    finally:
+        close_drive(handle)
+
+    values = sorted(speed for _, speed in speeds)
+    median = values[len(values) // 2]
+    print(f"Throughput min {values[0]:.1f} MB/s, median {median:.1f} MB/s, max {values[-1]:.1f} MB/s")
+    print(f"Access time: {access_stats.summary()}")
+    # A healthy curve falls smoothly from outer to inner zones, dips below its neighbours stand out
+    slow = [(start, speed) for i, (start, speed) in enumerate(speeds)
+            if speed < 0.7 * max(speeds[max(0, i - 5):i + 6], key=lambda item: item[1])[1]]
+    for start, speed in slow:
+        print(f"Slow zone at sector {start}: {speed:.1f} MB/s")
+    print(f"Curve written to '{sweep_report_file}'.")
+
+def run_random_reads(handles, min_sector, max_sector, count, queue_depth, seconds):
+    """Random reads of `count` sectors with `queue_depth` in flight for `seconds`.
+
+    Returns (sorted latencies in ms, errors, elapsed seconds).
+    """
+    deadline = time.perf_counter() + seconds
+    alignment = min(count, 8)  # 4 KiB aligned like a real workload
+
+    def worker():
+        handle, buffer = handles.get()
+        latencies = []
+        errors = 0
+        while time.perf_counter() < deadline:
+            sector = random.randrange(min_sector, max_sector - count + 1)
+            sector -= sector % alignment
+            try:
+                latencies.append(read_block(handle, sector, count, buffer))
+            except OSError:
+                errors += 1
+        return latencies, errors
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=queue_depth) as executor:
+        results = [future.result() for future in [executor.submit(worker) for _ in range(queue_depth)]]
+    elapsed = time.perf_counter() - start_time
+    latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+    return latencies, sum(errors for _, errors in results), elapsed
+
+def iops_benchmark_mode(settings, drive):
+    """Random read IOPS, MB/s and latency percentiles for every queue depth and block size."""
+    print(f"Running random read benchmark on drive {drive}...")
+    sector_range = scan_range(settings, drive)
+    if not sector_range:
+        return
+    min_sector, max_sector = sector_range
+    queue_depths = parse_positive_list(settings['iops_queue_depths'])
+    block_sizes = [size for size in parse_positive_list(settings['iops_block_sizes']) if size % SECTOR_SIZE == 0]
+    if not queue_depths or not block_sizes:
+        print("iops_queue_depths needs at least one queue depth above 0 and iops_block_sizes "
+              f"at least one block size that is a multiple of {SECTOR_SIZE} bytes.")
+        return
+    seconds = max(1, settings['iops_cell_seconds'])
+    handles = ReadOnlyHandles(drive, max(block_sizes) // SECTOR_SIZE)
+    cells = []
+    try:
+        for block_size in block_sizes:
+            for queue_depth in queue_depths:
+                count = block_size // SECTOR_SIZE
+                latencies, errors, elapsed = run_random_reads(handles, min_sector, max_sector, count, queue_depth, seconds)
+                cell = engine_cell(block_size, queue_depth, latencies, errors, elapsed)
+                cells.append(cell)
+                if latencies:
+                    print(f"{block_size:>8} B, QD {queue_depth:>2}: {cell['iops']:8.1f} IOPS, {cell['mb_per_s']:7.1f} MB/s, "
+                          f"p50 {cell['p50']:.2f}ms, p99 {cell['p99']:.2f}ms, p99.9 {cell['p999']:.2f}ms")
+                else:
+                    print(f"{block_size:>8} B, QD {queue_depth:>2}: no successful reads, {errors} errors")
+    finally:
+        handles.close()
+
+    with open(iops_report_file, 'w') as report:
+        report.write("block_size,queue_depth,iops,mb_per_s,p50_ms,p99_ms,p999_ms,errors\n")
+        for cell in cells:
+            latency_columns = ",".join(f"{cell[key]:.3f}" if cell[key] is not None else "" for key in ('p50', 'p99', 'p999'))
+            report.write(f"{cell['block_size']},{cell['queue_depth']},{cell['iops']:.1f},{cell['mb_per_s']:.2f},{latency_columns},{cell['errors']}\n")
+    print(f"Matrix written to '{iops_report_file}'.")
+
+    best = best_engine_config(cells, settings['max_latency'])
+    if best:
+        block_sectors = best['block_size'] // SECTOR_SIZE
+        print(f"Suggested scan engine: check_block_sectors = {block_sectors}, check_queue_depth = {best['queue_depth']} "
+              f"({best['mb_per_s']:.1f} MB/s, p99 {best['p99']:.2f}ms)")
+        save_drive_profile(get_drive_serial(drive), {'suggested_block_sectors': block_sectors, 'suggested_queue_depth': best['queue_depth']})
+
+def idle_scan_mode(settings, drive):
+    """Read-only scan that only reads while no other program uses the drive, resumable across runs.
+
+    The disk performance counters are read after every block, and after
+    every sector when a block is re-read sector by sector; any request of
+    another program since then, or one still queued, pauses the scan until
+    the drive has been quiet for idle_wait_ms. The cursor is kept in
+    the drive profile, so the scan continues where it stopped, also after a
+    reboot, and starts a new pass when it reaches the end of the range.
+    """
+    print(f"Running idle time scan on drive {drive}, stop it with Ctrl+C...")
+    sector_range = scan_range(settings, drive)
+    if not sector_range:
+        return
+    min_sector, max_sector = sector_range
+    block_sectors = max(1, settings['idle_block_sectors'])
+    idle_wait = settings['idle_wait_ms'] / 1000
+    poll = settings['idle_poll_ms'] / 1000
+    serial = get_drive_serial(drive)
+    profile = load_drive_profile(serial)
+    cursor = int(profile.get('idle_cursor', min_sector))
+    passes = int(profile.get('idle_passes', 0))
+    if not min_sector <= cursor < max_sector:
+        cursor = min_sector
+    print(f"Continuing at sector {cursor} ({100 * (cursor - min_sector) / (max_sector - min_sector):.1f}%), {passes} full passes done.")
+
+    query = open_drive(drive, 0, FILE_SHARE_READ_WRITE)  # Query access only
+    try:
+        baseline = get_disk_performance(query)
+    except OSError as e:
+        print(f"Disk performance counters not available ({e}), can't tell when the drive is idle.")
+        close_drive(query)
+        return
+    quiet_since = None
+
+    def wait_until_idle():
+        nonlocal baseline, quiet_since
+        while True:
+            counters = get_disk_performance(query)
+            if counters.queue_depth or counters.reads + counters.writes != baseline.reads + baseline.writes:
+                quiet_since = None  # Somebody else is using the drive
+                baseline = counters
+            elif quiet_since is None:
+                quiet_since = time.time()
+            if quiet_since is not None and time.time() - quiet_since >= idle_wait:
+                return
+            time.sleep(poll)
+
+    def pause():
+        # Between the reads of a block re-read sector by sector
+        nonlocal baseline
+        baseline = get_disk_performance(query)  # Our own reads are not someone else's
+        wait_until_idle()
+
+    handles = ReadOnlyHandles(drive, block_sectors)
+    scanned = 0
+    start_time = last_report = last_save = time.time()
+    try:
+        while True:
+            wait_until_idle()
+            count = min(block_sectors, max_sector - cursor)
+            latency, sectors = check_block(settings, handles, cursor, count, pause)
+            baseline = get_disk_performance(query)
+            now = time.time()
+            if sectors:
+                problems = [f"{s} | {status} | 0 | 0 | 1 | 0 | {f'{sector_latency:.2f}ms' if sector_latency is not None else 'read error'}\n"
+                            for s, status, sector_latency in sectors if status != '+']
+                if problems:
+                    with open(recovered_sectors_file, 'a') as f:
+                        f.writelines(problems)
+            cursor += count
+            scanned += count
+            if cursor >= max_sector:
+                passes += 1
+                cursor = min_sector
+                print(f"Pass {passes} over the whole range finished.")
+            report_progress(cursor - min_sector, max_sector - min_sector)
+
+            if now - last_save >= 10:
+                last_save = now
+                save_drive_profile(serial, {'idle_cursor': cursor, 'idle_passes': passes})
+            if now - last_report >= 60:
+                last_report = now
+                print(f"Cursor at sector {cursor} ({100 * (cursor - min_sector) / (max_sector - min_sector):.1f}%), "
+                      f"{scanned * SECTOR_SIZE / (1024 * 1024):.0f} MiB read in {(now - start_time) / 60:.0f} min")
+    except KeyboardInterrupt:
+        print("Stopped.")
+    finally:
+        save_drive_profile(serial, {'idle_cursor': cursor, 'idle_passes': passes})
+        handles.close()
+        close_drive(query)
+    print(f"Cursor saved at sector {cursor}, {scanned * SECTOR_SIZE / (1024 * 1024):.0f} MiB read this run.")
+
+def restore_mode(settings, drive):
+    """Write the original sector contents from the undo journal back to the drive."""
+    retries = settings['error_use_handle']
+    try:
+        journal = UndoJournal(drive)
+    except (OSError, ValueError) as e:
+        print(f"Not restoring to drive {drive}: {e}")
+        return
+    if not journal.saved:
+        print(f"No undo journal found for drive {drive} (serial {journal.serial}).")
+        journal.close()
+        return
+
+    print(f"Restoring {len(journal.saved)} sectors from {journal.index_path} on drive {drive}...")
+    skipped = restored = failed = 0
+    # The records of one write request are stored together, so the index is restored one request at a time
+    for offset, records in itertools.groupby(journal.entries(), key=lambda entry: entry[1]):
+        entries = []
+        for sector, _, slot, flags in records:
+            if flags & UNDO_UNREADABLE:
+                skipped += 1
+            else:
+                entries.append((sector, slot, flags))
+        if not entries:
+            continue
+        blob = journal.read_blob(offset) if any(not flags for _, _, flags in entries) else b''
+        entries.sort()
+        # Contiguous sectors of a blob are written back in one request
+        run_start, run_data = None, []
+        for index, (sector, slot, flags) in enumerate(entries):
+            run_data.append(bytes(SECTOR_SIZE) if flags & UNDO_ZERO else blob[slot * SECTOR_SIZE:(slot + 1) * SECTOR_SIZE])
+            if run_start is None:
+                run_start = sector
+            if index + 1 == len(entries) or entries[index + 1][0] != sector + 1:
+                if write_sectors_raw(drive, run_start, b''.join(run_data), retries):
+                    restored += len(run_data)
+                else:
+                    failed += len(run_data)
+                run_start, run_data = None, []
+
+    print(f"Restored {restored} sectors, {failed} failed, {skipped} were unreadable before and skipped.")
+    if failed:
+        journal.close()
+        print("The journal is kept, run the restore again to retry the failed sectors.")
+    else:
+        print(f"Journal retired to '{journal.retire()[1]}', the next destructive run starts a new one.")
+
+MODES = {
+    '1': ("Recovery mode", recovery_mode),
+    '2': ("Workout mode", workout_mode),
+    '3': ("f1 mode", f1_mode),
+    '4': ("Regenerator mode", regenerator_mode),
+    '5': ("Restore from undo journal", restore_mode),
+    '6': ("Read-only check", check_mode),
+    '7': ("Sampling health estimate", sampling_mode),
+    '8': ("Track calibration", track_calibration_mode),
+    '9': ("Drive characterisation", characterise_mode),
+    '10': ("Throughput sweep", sweep_mode),
+    '11': ("Random read benchmark", iops_benchmark_mode),
+    '12': ("Idle time scan", idle_scan_mode),
+}
+DESTRUCTIVE_MODES = (recovery_mode, workout_mode, f1_mode, regenerator_mode)
+
+def init_recovered_sectors_file():
+    """Create the recovered sectors file with a title line if it doesn't exist yet."""
     if not os.path.exists(recovered_sectors_file):
         with open(recovered_sectors_file, 'w') as f:
             f.write("Sector | Status | Attempts | Writes | Reads | Max Attempts | Notes\n")
 
-    drive = select_drive(settings)
-    if not drive:
+def run_on_drive(settings, drive, run_mode):
+    """Prepare the per-drive state (latency limit, sector alignment, undo journal) and run the mode."""
+    global undo_journal, physical_sector_size, io_throttle
+    if settings['auto_latency'] and run_mode is not characterise_mode:
+        max_latency = profile_max_latency(load_drive_profile(get_drive_serial(drive)), settings['latency_margin'])
+        if max_latency:
+            print(f"Using max_latency {max_latency}ms from the drive profile.")
+            settings['max_latency'] = max_latency
+        else:
+            print("No drive profile found, run the drive characterisation mode first. Using max_latency from settings.")
+    if settings['physical_align']:
+        physical_sector_size = get_physical_sector_size(drive)
+        physical_cache.clear()
+        if physical_sector_size > SECTOR_SIZE:
+            print(f"Drive has {physical_sector_size} byte physical sectors, writes are aligned to them.")
+    if settings['undo_journal'] and run_mode in DESTRUCTIVE_MODES:
+        try:
+            undo_journal = UndoJournal(drive)
+        except (OSError, ValueError) as e:
+            print(f"Can't open the undo journal of drive {drive}, nothing is written: {e}")
+            return
+    if settings['throttle_iops'] or settings['throttle_mib'] or settings['throttle_adaptive']:
+        io_throttle = IoThrottle(settings, drive)
+    try:
+        run_mode(settings, drive)
+    finally:
+        if undo_journal:
+            undo_journal.close()
+            undo_journal = None
+        if io_throttle:
+            io_throttle.close()
+            io_throttle = None
+
+def drive_worker(settings, drive, mode_key, shared_progress, slot, lock, budget):
+    """Run one mode on one drive in its own process, with output and results in a directory named after the drive."""
+    global progress, profile_lock, group_budget, drive_profiles_file
+    drive_profiles_file = os.path.abspath(drive_profiles_file)  # Profiles stay shared by all drives
+    os.makedirs(drive_name(drive), exist_ok=True)
+    os.chdir(drive_name(drive))
+    sys.stdout = sys.stderr = open('output.txt', 'a', buffering=1)
+    progress = (shared_progress, slot)
+    profile_lock = lock
+    group_budget = budget
+    init_recovered_sectors_file()
+    configure_retry_policy(settings)
+    run_on_drive(settings, drive, MODES[mode_key][1])
+    report_progress(1, 1)
+
+def run_drives(settings, drives, mode_key):
+    """Run one mode on several drives at once, one process per drive so they don't contend on the GIL."""
+    shared_progress = multiprocessing.Array('d', len(drives))
+    lock = multiprocessing.Lock()
+
+    # Drives behind one controller share its link, scanned at full speed together they
+    # queue on it and the added latency shows up as false slow sectors
+    budgets = {}
+    if settings['group_bandwidth_mib'] > 0:
+        controllers = get_drive_controllers()
+        rate = settings['group_bandwidth_mib'] * 1024 * 1024
+        groups = {}
+        for drive in drives:
+            groups.setdefault(controllers.get(drive, drive_name(drive)), []).append(drive)
+        for group, members in groups.items():
+            bucket = TokenBucket(rate, rate / 10)
+            for drive in members:
+                budgets[drive] = bucket
+            print(f"Controller {group}: {', '.join(drive_name(drive) for drive in members)}, {settings['group_bandwidth_mib']} MiB/s shared")
+
+    workers = [multiprocessing.Process(target=drive_worker, args=(settings, drive, mode_key, shared_progress, slot, lock, budgets.get(drive)))
+               for slot, drive in enumerate(drives)]
+    for worker in workers:
+        worker.start()
+    print(f"Running {MODES[mode_key][0].lower()} on {len(drives)} drives, output and results are in one directory per drive.")
+
+    def show_progress():
+        states = []
+        for slot, (drive, worker) in enumerate(zip(drives, workers)):
+            if worker.exitcode is None:
+                states.append(f"{drive_name(drive)} {100 * shared_progress[slot]:.1f}%")
+            else:
+                states.append(f"{drive_name(drive)} {'done' if worker.exitcode == 0 else f'failed ({worker.exitcode})'}")
+        print(f"{100 * sum(shared_progress) / len(drives):.1f}% | " + " | ".join(states))
+
+    try:
+        while any(worker.is_alive() for worker in workers):
+            finished = wait_for_any([worker.sentinel for worker in workers if worker.is_alive()], timeout=5)
+            for worker in workers:
+                if worker.sentinel in finished:
+                    worker.join()  # Reap it, is_alive() can lag behind the sentinel
+            show_progress()
+    except KeyboardInterrupt:
+        # The workers got the Ctrl+C as well and close their files and journals
+        print("Interrupted, waiting for the drives to stop...")
+        for worker in workers:
+            worker.join()
+        show_progress()
+
+def main():
+    settings = read_settings()
+    configure_retry_policy(settings)
+    init_recovered_sectors_file()
+
+    if settings['drive_numbers']:
+        drives = select_drives(settings)
+    else:
+        drive = select_drive(settings)
+        drives = [drive] if drive else None
+    if not drives:
         print("Failed to select drive.")
         return
 
     if settings['auto_mode']:
-        mode = settings['mode']
-        if mode == 1:
-            recovery_mode(settings, drive)
-        elif mode == 2:
-            workout_mode(settings, drive)
-        elif mode == 3:
-            f1_mode(settings, drive)
-        elif mode == 4:
-            regenerator_mode(settings, drive)
-        else:
+        mode_key = str(settings['mode'])
+        if mode_key not in MODES:
             print("Invalid mode in settings.")
+            return
     else:
         print("Select mode:")
-        print("1. Recovery mode")
-        print("2. Workout mode")
-        print("3. f1 mode")
-        print("4. Regenerator mode")
-        choice = input("Enter your choice: ")
-        if choice in ['1', '2', '3', '4']:
-            if choice == '1':
-                recovery_mode(settings, drive)
-            elif choice == '2':
-                workout_mode(settings, drive)
-            elif choice == '3':
-                f1_mode(settings, drive)
-            elif choice == '4':
-                regenerator_mode(settings, drive)
-        else:
+        for key, (name, _) in MODES.items():
+            print(f"{key}. {name}")
+        mode_key = input("Enter your choice: ").strip()
+        if mode_key not in MODES:
             print("Invalid choice.")
+            return
+
+    _, run_mode = MODES[mode_key]
+    if len(drives) == 1:
+        run_on_drive(settings, drives[0], run_mode)
+    elif run_mode is workout_mode:
+        print("Workout mode asks for input, run it on one drive at a time.")
+    else:
+        run_drives(settings, drives, mode_key)
 
 if __name__ == "__main__":
     main()